@@ -0,0 +1,245 @@
+"""
+ * Copyright (C) Caleb Marshall - All Rights Reserved
+ * Written by Caleb Marshall <anythingtechpro@gmail.com>, April 23rd, 2017
+ * Licensing information can found in 'LICENSE', which is part of this source code package.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import redstone.entity as entity
+
+
+class BenchmarkDispatcher(object):
+
+    def __init__(self):
+        self.numPackets = 0
+
+    def handleDispatch(self, direction, packetId, *args, **kwargs):
+        self.numPackets += 1
+
+class BenchmarkSendQueue(object):
+    paused = False
+
+class BenchmarkProtocol(object):
+
+    def __init__(self):
+        self.dispatcher = BenchmarkDispatcher()
+        self.sendQueue = BenchmarkSendQueue()
+
+class BenchmarkFactory(object):
+
+    def __init__(self):
+        self.numPackets = 0
+
+    def broadcastTo(self, protocols, direction, packetId, exceptions, *args, **kwargs):
+        self.numPackets += len(protocols)
+
+class BenchmarkWorldManager(object):
+    viewRadius = 128
+
+    def __init__(self):
+        self.factory = BenchmarkFactory()
+
+class BenchmarkWorld(object):
+
+    def __init__(self):
+        self.worldManager = BenchmarkWorldManager()
+        self.entityManager = entity.EntityManager(self.worldManager.viewRadius)
+        self.movementManager = entity.EntityMovementManager(self)
+
+class LegacyEntity(object):
+    # the entity state as it was before the entity state table, attributes
+    # behind properties on every entity.
+
+    def __init__(self, x, y, z, yaw, pitch):
+        self._x, self._y, self._z, self._yaw, self._pitch = x, y, z, yaw, pitch
+        self._sentPosition = None
+
+    @property
+    def x(self):
+        return self._x
+
+    @x.setter
+    def x(self, x):
+        self._x = x
+
+    @property
+    def y(self):
+        return self._y
+
+    @property
+    def z(self):
+        return self._z
+
+    @z.setter
+    def z(self, z):
+        self._z = z
+
+    @property
+    def yaw(self):
+        return self._yaw
+
+    @yaw.setter
+    def yaw(self, yaw):
+        self._yaw = yaw
+
+    @property
+    def sentPosition(self):
+        return self._sentPosition
+
+    @sentPosition.setter
+    def sentPosition(self, sentPosition):
+        self._sentPosition = sentPosition
+
+    def getDistanceSquared(self, x, z):
+        return (self._x - x) ** 2 + (self._z - z) ** 2
+
+    def getFixedPosition(self):
+        return (int(round(self._x * 32.0)), int(round(self._y * 32.0)), int(round(self._z * 32.0)),
+            self._yaw, self._pitch)
+
+def legacyUpdateMovement(entities):
+    # mirrors the old EntityMovementManager.updateEntity, one entity at a time.
+    movements = []
+
+    for legacyEntity in entities:
+        x, y, z, yaw, pitch = position = legacyEntity.getFixedPosition()
+
+        if legacyEntity.sentPosition is None:
+            legacyEntity.sentPosition = position
+
+        sentX, sentY, sentZ, sentYaw, sentPitch = legacyEntity.sentPosition
+        changeX, changeY, changeZ = x - sentX, y - sentY, z - sentZ
+
+        moved = changeX or changeY or changeZ
+        rotated = yaw != sentYaw or pitch != sentPitch
+
+        if not moved and not rotated:
+            continue
+
+        legacyEntity.sentPosition = position
+        movements.append((legacyEntity, changeX, changeY, changeZ))
+
+    return movements
+
+def legacyCulling(entities, viewRadius):
+    numVisible = 0
+
+    for legacyEntity in entities:
+        for otherEntity in entities:
+            if otherEntity.getDistanceSquared(legacyEntity.x, legacyEntity.z) <= viewRadius * viewRadius:
+                numVisible += 1
+
+    return numVisible
+
+def tableCulling(entities, table, viewRadius):
+    numVisible = 0
+
+    for benchmarkEntity in entities:
+        numVisible += len(table.getEntitiesInRange(benchmarkEntity.x, benchmarkEntity.z, viewRadius))
+
+    return numVisible
+
+def moveEntities(entities, size):
+    for benchmarkEntity in entities:
+        # most players walk a little each tick, a few teleport.
+        if random.random() < 0.05:
+            benchmarkEntity.x = random.uniform(0, size)
+            benchmarkEntity.z = random.uniform(0, size)
+        else:
+            benchmarkEntity.x = min(max(benchmarkEntity.x + random.uniform(-0.5, 0.5), 0), size)
+            benchmarkEntity.z = min(max(benchmarkEntity.z + random.uniform(-0.5, 0.5), 0), size)
+
+        benchmarkEntity.yaw = random.randrange(256)
+
+def measure(function, iterations, setup=None):
+    timings = []
+
+    for _ in xrange(iterations):
+        if setup:
+            setup()
+
+        startTime = time.time()
+        function()
+        timings.append(time.time() - startTime)
+
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='Entity movement benchmark.')
+
+    parser.add_argument('--iterations', type=int, nargs='?',
+        help='The number of ticks to time per case...', default=20)
+
+    parser.add_argument('--entities', type=int, nargs='?',
+        help='The number of entities in the world...', default=250)
+
+    parser.add_argument('--size', type=int, nargs='?',
+        help='The width and depth of the area the entities move around in...', default=512)
+
+    args = parser.parse_args()
+
+    benchmarkWorld = BenchmarkWorld()
+    entityManager = benchmarkWorld.entityManager
+    movementManager = benchmarkWorld.movementManager
+
+    entities = []
+    legacyEntities = []
+
+    for entityId in xrange(args.entities):
+        playerEntity = entity.PlayerEntity(BenchmarkProtocol())
+        playerEntity.id = entityId
+        playerEntity.x = random.uniform(0, args.size)
+        playerEntity.y = 34
+        playerEntity.z = random.uniform(0, args.size)
+
+        entityManager.addEntity(playerEntity)
+        entities.append(playerEntity)
+
+        playerEntity.spawned = True
+        movementManager.resetEntity(playerEntity)
+        movementManager.markDirty(playerEntity)
+
+        legacyEntities.append(LegacyEntity(playerEntity.x, playerEntity.y, playerEntity.z, 0, 0))
+
+    # spawns every entity for the players that can see it.
+    movementManager.update()
+
+    def moveAll():
+        moveEntities(entities, args.size)
+        moveEntities(legacyEntities, args.size)
+
+        for playerEntity in entities:
+            movementManager.markDirty(playerEntity)
+
+    table = entityManager.table
+    rows = [playerEntity.row for playerEntity in entities]
+    viewRadius = entityManager.viewRadius
+
+    before = measure(lambda: legacyUpdateMovement(legacyEntities), args.iterations, moveAll)
+    after = measure(lambda: table.updateMovement(rows), args.iterations, moveAll)
+
+    print 'movement deltas:    per entity %8.3f ms  table %8.3f ms  (%.1fx)' % (before * 1000.0,
+        after * 1000.0, before / after)
+
+    before = measure(lambda: legacyCulling(legacyEntities, viewRadius), args.iterations, moveAll)
+    after = measure(lambda: tableCulling(entities, table, viewRadius), args.iterations, moveAll)
+
+    print 'distance culling:   per entity %8.3f ms  table %8.3f ms  (%.1fx)' % (before * 1000.0,
+        after * 1000.0, before / after)
+
+    tick = measure(movementManager.update, args.iterations, moveAll)
+
+    print 'full movement tick: %8.3f ms for %d entities (%d packets sent)' % (tick * 1000.0,
+        args.entities, benchmarkWorld.worldManager.factory.numPackets)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""
+ * Copyright (C) Caleb Marshall - All Rights Reserved
+ * Written by Caleb Marshall <anythingtechpro@gmail.com>, April 23rd, 2017
+ * Licensing information can found in 'LICENSE', which is part of this source code package.
+"""
+
+import os
+import sys
+import time
+import shutil
+import socket
+import urlparse
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from twisted.internet import reactor, defer, task as twistedTask
+from twisted.internet.protocol import ProcessProtocol
+from twisted.web import resource, server
+
+import redstone.network as network
+import redstone.task as task
+
+
+class RecordingResource(resource.Resource):
+    """
+    A stand-in for the server list which records every heartbeat it's sent,
+    it can answer them, fail them or never answer at all
+    """
+
+    isLeaf = True
+
+    def __init__(self, mode):
+        resource.Resource.__init__(self)
+
+        self.mode = mode
+        self.heartbeats = []
+        self.numOpen = 0
+        self.maxOpen = 0
+
+    def render_POST(self, request):
+        self.heartbeats.append((time.time(), urlparse.parse_qs(request.content.read())))
+        self.numOpen += 1
+        self.maxOpen = max(self.maxOpen, self.numOpen)
+
+        request.notifyFinish().addBoth(self.handleFinish)
+
+        if self.mode == 'error':
+            request.setResponseCode(500)
+            return 'error'
+
+        if self.mode == 'hang':
+            return server.NOT_DONE_YET
+
+        return 'http://127.0.0.1/server/play/check'
+
+    def handleFinish(self, result):
+        self.numOpen -= 1
+
+class CheckDaemon(object):
+    port = 25565
+    name = 'Heartbeat Check'
+    public = True
+    software = 'Redstone'
+
+class CheckWorldManager(object):
+    numPlayers = 3
+
+class CheckFactory(task.TaskManager):
+
+    def __init__(self):
+        task.TaskManager.__init__(self)
+
+        self.daemon = CheckDaemon()
+        self.salt = 'check-salt'
+        self.worldManager = CheckWorldManager()
+
+class ServerProcessProtocol(ProcessProtocol):
+
+    def __init__(self):
+        self.ended = defer.Deferred()
+
+    def processEnded(self, reason):
+        self.ended.callback(None)
+
+def sleep(seconds):
+    return twistedTask.deferLater(reactor, seconds, lambda: None)
+
+def getFreePort():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+@defer.inlineCallbacks
+def runStatus(mode, duration, delay, timeout, maxDelay):
+    # runs a heartbeat against a stand-in server list for a while and
+    # returns what the server list saw.
+    recorder = RecordingResource(mode)
+    listeningPort = reactor.listenTCP(0, server.Site(recorder), interface='127.0.0.1')
+
+    factory = CheckFactory()
+    status = network.NetworkStatus(factory, 'http://127.0.0.1:%d/' % listeningPort.getHost().port,
+        delay=delay, timeout=timeout, maxDelay=maxDelay)
+
+    status.setup()
+    factory.run()
+
+    yield sleep(duration)
+
+    factory.destroy()
+    yield listeningPort.stopListening()
+
+    # let a heartbeat which is still in flight fail before the next check.
+    yield sleep(timeout)
+
+    defer.returnValue((recorder, status))
+
+def getGaps(heartbeats):
+    return [heartbeats[index][0] - heartbeats[index - 1][0] for index in xrange(1, len(heartbeats))]
+
+@defer.inlineCallbacks
+def checkSuccess(args):
+    recorder, status = yield runStatus('ok', args.delay * 6, args.delay, args.timeout, args.maxDelay)
+    errors = []
+
+    if len(recorder.heartbeats) < 3:
+        errors.append('expected at least 3 heartbeats, got %d' % len(recorder.heartbeats))
+
+    for _, fields in recorder.heartbeats:
+        if fields.get('salt') != ['check-salt'] or fields.get('users') != ['3'] or fields.get('version') != ['7']:
+            errors.append('unexpected heartbeat fields %r' % fields)
+            break
+
+    # a heartbeat which succeeds is sent again after the normal delay.
+    if any(gap < args.delay * 0.9 for gap in getGaps(recorder.heartbeats)):
+        errors.append('heartbeats sent faster than the delay: %r' % getGaps(recorder.heartbeats))
+
+    if status.failures or status.serverUrl != 'http://127.0.0.1/server/play/check':
+        errors.append('failures %d, server url %r' % (status.failures, status.serverUrl))
+
+    defer.returnValue(errors)
+
+@defer.inlineCallbacks
+def checkTimeout(args):
+    recorder, status = yield runStatus('hang', args.delay + (args.timeout + args.delay) * 3,
+        args.delay, args.timeout, args.maxDelay)
+
+    errors = []
+
+    if not recorder.heartbeats or not status.failures:
+        errors.append('expected the heartbeat to time out, %d sent %d failures' % (len(recorder.heartbeats),
+            status.failures))
+
+    # a server list that never answers mustn't pile up connections.
+    if recorder.maxOpen > 1:
+        errors.append('%d heartbeats were in flight at once' % recorder.maxOpen)
+
+    if any(gap < args.timeout + args.delay * 0.9 for gap in getGaps(recorder.heartbeats)):
+        errors.append('heartbeat sent before the last one timed out: %r' % getGaps(recorder.heartbeats))
+
+    defer.returnValue(errors)
+
+@defer.inlineCallbacks
+def checkBackoff(args):
+    recorder, status = yield runStatus('error', args.maxDelay * 3, args.delay, args.timeout, args.maxDelay)
+    errors = []
+
+    gaps = getGaps(recorder.heartbeats)
+
+    if len(gaps) < 3:
+        errors.append('expected at least 4 failed heartbeats, got %d' % len(recorder.heartbeats))
+
+    # the n'th retry is somewhere between the delay and the delay doubled n
+    # times, but never later than the maximum delay.
+    for failures, gap in enumerate(gaps, 1):
+        backoffDelay = min(args.maxDelay, args.delay * 2 ** failures)
+
+        if not args.delay * 0.9 <= gap <= backoffDelay + 0.25:
+            errors.append('retry %d after %.2f seconds, expected %.2f to %.2f' % (failures, gap, args.delay,
+                backoffDelay))
+
+    # the last heartbeat may still be in flight when the check stops.
+    if status.failures < len(recorder.heartbeats) - 1:
+        errors.append('%d failures for %d heartbeats' % (status.failures, len(recorder.heartbeats)))
+
+    defer.returnValue(errors)
+
+@defer.inlineCallbacks
+def checkServer(args):
+    # the real server, started with --heartbeat-url pointing at the stand-in.
+    recorder = RecordingResource('ok')
+    listeningPort = reactor.listenTCP(0, server.Site(recorder), interface='127.0.0.1')
+    serverPort = getFreePort()
+
+    mainPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'main.py')
+    workingDirectory = tempfile.mkdtemp()
+    processProtocol = ServerProcessProtocol()
+
+    process = reactor.spawnProcess(processProtocol, sys.executable, [sys.executable, mainPath,
+        '--address', '127.0.0.1', '--port', str(serverPort), '--heartbeat-url',
+        'http://127.0.0.1:%d/' % listeningPort.getHost().port], env=os.environ, path=workingDirectory)
+
+    # the first heartbeat is sent once the status task's delay has passed.
+    startTime = time.time()
+
+    while not recorder.heartbeats and time.time() - startTime < args.serverTimeout:
+        yield sleep(0.1)
+
+    process.signalProcess('TERM')
+    yield processProtocol.ended
+    yield listeningPort.stopListening()
+
+    shutil.rmtree(workingDirectory, ignore_errors=True)
+
+    if not recorder.heartbeats:
+        defer.returnValue(['the server sent no heartbeat within %.1f seconds' % args.serverTimeout])
+
+    _, fields = recorder.heartbeats[0]
+
+    if fields.get('port') != [str(serverPort)] or fields.get('users') != ['0']:
+        defer.returnValue(['unexpected heartbeat fields %r' % fields])
+
+    defer.returnValue([])
+
+CHECKS = [
+    ('success', checkSuccess),
+    ('timeout', checkTimeout),
+    ('backoff', checkBackoff),
+    ('server', checkServer),
+]
+
+@defer.inlineCallbacks
+def runChecks(args):
+    numFailed = 0
+
+    for name, check in CHECKS:
+        if args.checks and name not in args.checks:
+            continue
+
+        startTime = time.time()
+        errors = yield check(args)
+
+        print '%-8s %s  (%.1f s)' % (name, 'FAILED' if errors else 'ok', time.time() - startTime)
+
+        for error in errors:
+            print '    %s' % error
+
+        numFailed += bool(errors)
+
+    defer.returnValue(numFailed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Server list heartbeat check against a local stand-in.')
+
+    parser.add_argument('checks', type=str, nargs='*',
+        help='The checks to run out of %s, every check is ran by default...' % ', '.join([name for name, _ in CHECKS]))
+
+    parser.add_argument('--delay', type=float, nargs='?',
+        help='The number of seconds between heartbeats...', default=0.2)
+
+    parser.add_argument('--timeout', type=float, nargs='?',
+        help='The number of seconds a heartbeat may take before it fails...', default=0.5)
+
+    parser.add_argument('--max-delay', dest='maxDelay', type=float, nargs='?',
+        help='The maximum number of seconds between heartbeats while they fail...', default=1.6)
+
+    parser.add_argument('--server-timeout', dest='serverTimeout', type=float, nargs='?',
+        help='The number of seconds to wait for the first heartbeat of the real server...', default=20.0)
+
+    args = parser.parse_args()
+    result = []
+
+    for name in args.checks:
+        if name not in dict(CHECKS):
+            parser.error('unknown check %s' % name)
+
+    def run():
+        deferred = runChecks(args)
+        deferred.addCallback(result.append)
+        deferred.addBoth(lambda _: reactor.stop())
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+
+    return 1 if not result or result[0] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+ * Copyright (C) Caleb Marshall - All Rights Reserved
+ * Written by Caleb Marshall <anythingtechpro@gmail.com>, April 23rd, 2017
+ * Licensing information can found in 'LICENSE', which is part of this source code package.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import redstone.util as util
+import redstone.entity as entity
+import redstone.packet as packet
+
+
+class BenchmarkProtocol(object):
+
+    def __init__(self):
+        self.entity = entity.PlayerEntity(self)
+        self.entity.id = 1
+
+def withPacketId(packetId, dataBuffer):
+    # mirrors the old PacketDispatcher.handleSend which copied the
+    # serialized packet into another buffer behind the packet id.
+    otherDataBuffer = util.DataBuffer()
+    otherDataBuffer.writeByte(packetId)
+    otherDataBuffer.write(dataBuffer.data)
+    return otherDataBuffer.data
+
+def legacySetBlock(x, y, z, blockType):
+    dataBuffer = util.DataBuffer()
+    dataBuffer.writeShort(x)
+    dataBuffer.writeShort(y)
+    dataBuffer.writeShort(z)
+    dataBuffer.writeByte(blockType)
+
+    return withPacketId(packet.SetBlockServer.ID, dataBuffer)
+
+def legacyPosition(entityId, x, y, z, yaw, pitch):
+    dataBuffer = util.DataBuffer()
+    dataBuffer.writeSByte(entityId)
+    dataBuffer.writeShort(x * 32.0)
+    dataBuffer.writeShort(y * 32.0)
+    dataBuffer.writeShort(z * 32.0)
+    dataBuffer.writeByte(yaw)
+    dataBuffer.writeByte(pitch)
+
+    return withPacketId(packet.PositionAndOrientationStatic.ID, dataBuffer)
+
+def legacyMessage(entityId, message):
+    dataBuffer = util.DataBuffer()
+    dataBuffer.writeSByte(entityId)
+    dataBuffer.writeString(message)
+
+    return withPacketId(packet.ServerMessage.ID, dataBuffer)
+
+def legacyPositionDecode(data):
+    dataBuffer = util.DataBuffer(data)
+    dataBuffer.readByte()
+
+    return (dataBuffer.readByte(), dataBuffer.readShort(), dataBuffer.readShort(),
+        dataBuffer.readShort(), dataBuffer.readByte(), dataBuffer.readByte())
+
+def measure(function, args, iterations):
+    startTime = time.time()
+
+    for _ in xrange(iterations):
+        function(*args)
+
+    return iterations / (time.time() - startTime)
+
+def main():
+    parser = argparse.ArgumentParser(description='Packet codec benchmark.')
+
+    parser.add_argument('--iterations', type=int, nargs='?',
+        help='The number of packets to encode or decode per case...', default=200000)
+
+    args = parser.parse_args()
+
+    protocol = BenchmarkProtocol()
+    positionArgs = (2, 33.5, 34.0, 33.5, 64, 0)
+    positionData = packet.PositionAndOrientationStatic.STRUCT.pack(
+        packet.PositionAndOrientationStatic.ID, 2, 1072, 1088, 1072, 64, 0)
+
+    cases = [
+        ('SetBlockServer encode', legacySetBlock, packet.SetBlockServer(None, protocol).serialize,
+            (10, 33, 10, util.BlockIds.COBBLESTONE)),
+
+        ('PositionAndOrientationStatic encode', legacyPosition,
+            packet.PositionAndOrientationStatic(None, protocol).serialize, positionArgs),
+
+        ('ServerMessage encode', legacyMessage, packet.ServerMessage(None, protocol).serialize,
+            (1, 'player: hello world!')),
+
+        ('PositionAndOrientation decode', legacyPositionDecode,
+            packet.PositionAndOrientation.STRUCT.unpack_from, (memoryview(positionData),)),
+    ]
+
+    for name, legacyFunction, function, functionArgs in cases:
+        before = measure(legacyFunction, functionArgs, args.iterations)
+        after = measure(function, functionArgs, args.iterations)
+
+        print '%-36s before: %10.0f packets/s  after: %10.0f packets/s  (%.1fx)' % (
+            name, before, after, after / before)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
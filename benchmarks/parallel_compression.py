@@ -0,0 +1,97 @@
+"""
+ * Copyright (C) Caleb Marshall - All Rights Reserved
+ * Written by Caleb Marshall <anythingtechpro@gmail.com>, April 23rd, 2017
+ * Licensing information can found in 'LICENSE', which is part of this source code package.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import redstone.util as util
+import redstone.world as world
+import redstone.compression as compression
+
+
+class BenchmarkWorldManager(object):
+    viewRadius = 128
+
+def createWorld(width, height, depth, numEdits):
+    benchmarkWorld = world.World(BenchmarkWorldManager(), 'benchmark', width=width, height=height,
+        depth=depth)
+
+    # scatter some blocks around so the world isn't trivial to compress.
+    blockIds = [util.BlockIds.COBBLESTONE, util.BlockIds.WOOD_PLANKS, util.BlockIds.GRAVEL, util.BlockIds.SAND]
+
+    for _ in xrange(numEdits):
+        benchmarkWorld.setBlock(random.randrange(width), random.randrange(height), random.randrange(depth),
+            random.choice(blockIds), update=False)
+
+    return benchmarkWorld
+
+def measure(function, iterations):
+    timings = []
+
+    for _ in xrange(iterations):
+        startTime = time.time()
+        function()
+        timings.append(time.time() - startTime)
+
+    return min(timings)
+
+def main():
+    cpuCount = multiprocessing.cpu_count()
+    parser = argparse.ArgumentParser(description='Parallel world compression benchmark.')
+
+    parser.add_argument('--iterations', type=int, nargs='?',
+        help='The number of times each world is compressed per worker count...', default=3)
+
+    parser.add_argument('--workers', type=int, nargs='*',
+        help='The worker counts to compress with...', default=sorted(set([1, 2, 4, cpuCount])))
+
+    parser.add_argument('--size', type=int, nargs=3,
+        help='The width, height and depth of the world...', default=[256, 64, 256])
+
+    parser.add_argument('--edits', type=int, nargs='?',
+        help='The number of random blocks placed in the world...', default=200000)
+
+    args = parser.parse_args()
+
+    width, height, depth = args.size
+    benchmarkWorld = createWorld(width, height, depth, args.edits)
+    megabytes = (benchmarkWorld.blockData.volume + 4) / (1024.0 * 1024.0)
+    expected = benchmarkWorld.blockData.toBytes()
+
+    print 'compressing a %dx%dx%d world (%.1f MB) at level 9 on %d cores' % (width, height, depth,
+        megabytes, cpuCount)
+
+    before = measure(benchmarkWorld.serialize, args.iterations)
+    print 'single stream:  %8.2f ms  %7.1f MB/s  %8d bytes' % (before * 1000.0, megabytes / before,
+        len(benchmarkWorld.serialize()))
+
+    for numWorkers in args.workers:
+        compressor = compression.ParallelGzipCompressor(numWorkers)
+
+        try:
+            after = measure(lambda: benchmarkWorld.serialize(compressor), args.iterations)
+            data = benchmarkWorld.serialize(compressor)
+        finally:
+            compressor.close()
+
+        print '%2d workers:     %8.2f ms  %7.1f MB/s  %8d bytes  (%.1fx)' % (numWorkers, after * 1000.0,
+            megabytes / after, len(data), before / after)
+
+        # the output has to be a normal gzip stream the world loader accepts.
+        if world.World.load(data, width, height, depth).toBytes() != expected:
+            print 'ERROR: compressed world differs from the world block data!'
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
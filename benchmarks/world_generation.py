@@ -0,0 +1,72 @@
+"""
+ * Copyright (C) Caleb Marshall - All Rights Reserved
+ * Written by Caleb Marshall <anythingtechpro@gmail.com>, April 23rd, 2017
+ * Licensing information can found in 'LICENSE', which is part of this source code package.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import redstone.world as world
+
+
+class BenchmarkWorldManager(object):
+    viewRadius = 128
+
+def generateLegacy():
+    # the original per block generator, kept here as the reference output.
+    blockData = bytearray(world.World.WIDTH * world.World.HEIGHT * world.World.DEPTH)
+
+    for x in range(world.World.WIDTH):
+        for y in range(world.World.HEIGHT):
+            for z in range(world.World.DEPTH):
+                blockData[x + world.World.DEPTH * (z + world.World.WIDTH * y)] = 0 if y > 32 else \
+                    (2 if y == 32 else 3)
+
+    return blockData
+
+def measure(function, iterations):
+    timings = []
+
+    for _ in xrange(iterations):
+        startTime = time.time()
+        function()
+        timings.append(time.time() - startTime)
+
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='World generation benchmark.')
+
+    parser.add_argument('--iterations', type=int, nargs='?',
+        help='The number of worlds to generate per generator...', default=10)
+
+    parser.add_argument('--skip-legacy', action='store_true',
+        help='Skips the slow per block reference generator...')
+
+    args = parser.parse_args()
+
+    createWorld = lambda: world.World(BenchmarkWorldManager(), 'benchmark')
+
+    print 'World.__generate: %.2f ms per world (best of %d)' % (
+        measure(createWorld, args.iterations) * 1000.0, args.iterations)
+
+    if args.skip_legacy:
+        return 0
+
+    print 'legacy generator: %.2f ms per world (best of 1)' % (
+        measure(generateLegacy, 1) * 1000.0)
+
+    if createWorld().blockData.toBytes() != generateLegacy():
+        print 'ERROR: generated block data differs from the legacy generator!'
+        return 1
+
+    print 'generated block data is byte-identical to the legacy generator.'
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
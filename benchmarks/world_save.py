@@ -0,0 +1,97 @@
+"""
+ * Copyright (C) Caleb Marshall - All Rights Reserved
+ * Written by Caleb Marshall <anythingtechpro@gmail.com>, April 23rd, 2017
+ * Licensing information can found in 'LICENSE', which is part of this source code package.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import redstone.util as util
+import redstone.world as world
+import redstone.region as region
+
+
+class BenchmarkWorldManager(object):
+    viewRadius = 128
+
+def editWorld(benchmarkWorld, numEdits):
+    for _ in xrange(numEdits):
+        benchmarkWorld.setBlock(random.randrange(benchmarkWorld.width), random.randrange(benchmarkWorld.height),
+            random.randrange(benchmarkWorld.depth), util.BlockIds.COBBLESTONE, update=False)
+
+def saveDat(io, filename, benchmarkWorld):
+    io.writeAtomic(filename, benchmarkWorld.serialize())
+
+def saveRegion(worldRegion, benchmarkWorld):
+    worldRegion.writeChunks(worldRegion.getDirtyChunks(benchmarkWorld.blockData,
+        benchmarkWorld.dirtyChunks))
+
+def measure(benchmarkWorld, numEdits, save, iterations):
+    timings = []
+
+    for _ in xrange(iterations):
+        editWorld(benchmarkWorld, numEdits)
+
+        startTime = time.time()
+        save()
+        timings.append(time.time() - startTime)
+
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description='World save benchmark.')
+
+    parser.add_argument('--iterations', type=int, nargs='?',
+        help='The number of saves to time per case...', default=5)
+
+    parser.add_argument('--edits', type=int, nargs='*',
+        help='The number of random block edits made before each save...', default=[1, 10, 100, 1000])
+
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        benchmarkWorld = world.World(BenchmarkWorldManager(), 'benchmark')
+        io = world.WorldManagerIO()
+
+        filename = os.path.join(directory, 'benchmark.dat')
+        worldRegion = region.RegionFile(os.path.join(directory, 'benchmark.region'),
+            benchmarkWorld.width, benchmarkWorld.height, benchmarkWorld.depth)
+
+        worldRegion.create(benchmarkWorld.blockData)
+
+        for numEdits in args.edits:
+            before = measure(benchmarkWorld, numEdits, lambda: saveDat(io, filename, benchmarkWorld),
+                args.iterations)
+
+            after = measure(benchmarkWorld, numEdits, lambda: saveRegion(worldRegion, benchmarkWorld),
+                args.iterations)
+
+            print '%5d edits  dat: %8.2f ms  region: %8.2f ms  (%.1fx)' % (numEdits,
+                before * 1000.0, after * 1000.0, before / after)
+
+        # the region file has to hold exactly the same blocks as the world.
+        worldRegion.close()
+        worldRegion.open()
+
+        if worldRegion.readBlockData().toBytes() != benchmarkWorld.blockData.toBytes():
+            print 'ERROR: region file differs from the world block data!'
+            return 1
+
+        worldRegion.close()
+    finally:
+        shutil.rmtree(directory)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
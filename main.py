@@ -6,16 +6,20 @@
 
 import sys
 import argparse
+import multiprocessing
 
 from twisted.internet import reactor
 
 import redstone
+import redstone.logging as logging
 import redstone.network as network
 
 
 class MinecraftServer(object):
 
-    def __init__(self, backlog, address, port, name, motd, software, public):
+    def __init__(self, backlog, address, port, name, motd, software, public, tickRate, viewRadius,
+        heartbeatUrl, journalInterval, worldFormat, maxWorlds, worldIdleTimeout, levelCompression,
+        compressionThreads, randomTickSpeed, sendBufferLimit):
         self._backlog = backlog
         self._address = address
         self._port = port
@@ -23,6 +27,17 @@ class MinecraftServer(object):
         self._motd = motd
         self._software = software
         self._public = public
+        self._tickRate = tickRate
+        self._viewRadius = viewRadius
+        self._heartbeatUrl = heartbeatUrl
+        self._journalInterval = journalInterval
+        self._worldFormat = worldFormat
+        self._maxWorlds = maxWorlds
+        self._worldIdleTimeout = worldIdleTimeout
+        self._levelCompression = levelCompression
+        self._compressionThreads = compressionThreads
+        self._randomTickSpeed = randomTickSpeed
+        self._sendBufferLimit = sendBufferLimit
 
     @property
     def address(self):
@@ -48,6 +63,50 @@ class MinecraftServer(object):
     def public(self):
         return self._public
 
+    @property
+    def tickRate(self):
+        return self._tickRate
+
+    @property
+    def viewRadius(self):
+        return self._viewRadius
+
+    @property
+    def heartbeatUrl(self):
+        return self._heartbeatUrl
+
+    @property
+    def journalInterval(self):
+        return self._journalInterval
+
+    @property
+    def worldFormat(self):
+        return self._worldFormat
+
+    @property
+    def maxWorlds(self):
+        return self._maxWorlds
+
+    @property
+    def worldIdleTimeout(self):
+        return self._worldIdleTimeout
+
+    @property
+    def levelCompression(self):
+        return self._levelCompression
+
+    @property
+    def compressionThreads(self):
+        return self._compressionThreads
+
+    @property
+    def randomTickSpeed(self):
+        return self._randomTickSpeed
+
+    @property
+    def sendBufferLimit(self):
+        return self._sendBufferLimit
+
     def setup(self):
         self._factory = network.NetworkFactory(self)
         reactor.listenTCP(self._port, self._factory, backlog=self._backlog,
@@ -82,12 +141,63 @@ def main():
     parser.add_argument('--public', type=bool, nargs='?',
         help='Boolean that determines if the server is visible on the public server list...', default=True)
 
+    parser.add_argument('--tickrate', type=int, nargs='?',
+        help='The number of world ticks per second, movement is broadcasted once per tick...', default=20)
+
+    parser.add_argument('--view-radius', type=int, nargs='?',
+        help='The distance in blocks in which players can see each other...', default=128)
+
+    parser.add_argument('--heartbeat-url', type=str, nargs='?',
+        help='The server list url the heartbeat is sent to...', default='http://www.classicube.net/server/heartbeat')
+
+    parser.add_argument('--journal-interval', type=float, nargs='?',
+        help='The number of seconds between syncing each world\'s block change journal to disk...', default=1.0)
+
+    parser.add_argument('--world-format', type=str, nargs='?', choices=['dat', 'region'],
+        help='The format worlds are stored in, existing dat worlds are converted to region files...', default='dat')
+
+    parser.add_argument('--max-worlds', type=int, nargs='?',
+        help='The maximum number of worlds kept in memory, the least recently used empty world is unloaded first...', default=8)
+
+    parser.add_argument('--world-idle-timeout', type=float, nargs='?',
+        help='The number of seconds a world has to be empty before it\'s saved and unloaded...', default=300.0)
+
+    parser.add_argument('--level-compression', type=int, nargs='?', choices=range(1, 10),
+        help='The compression level used when sending worlds to players, from 1 (fastest) to 9 (smallest)...', default=6)
+
+    parser.add_argument('--compression-threads', type=int, nargs='?',
+        help='The number of threads used to compress world saves, 1 compresses on a single thread...', default=multiprocessing.cpu_count())
+
+    parser.add_argument('--random-tick-speed', type=int, nargs='?',
+        help='The number of random blocks updated per 16x16x16 chunk each tick, 0 disables grass spreading and tree growth...', default=3)
+
+    parser.add_argument('--send-buffer-limit', type=int, nargs='?',
+        help='The maximum number of bytes queued for a player which isn\'t keeping up before they are disconnected...', default=8 * 1024 * 1024)
+
+    parser.add_argument('--log-level', type=str, nargs='?', choices=['debug', 'info', 'warning', 'error'],
+        help='The minimum level of messages that are logged...', default='info')
+
+    parser.add_argument('--log-json', type=str, nargs='?',
+        help='An optional file which every log message is also written to as json...', default=None)
+
+    parser.add_argument('--log-rate-limit', type=int, nargs='?',
+        help='The maximum number of times the same message is logged per second...', default=20)
+
     args = parser.parse_args()
 
+    # setup the logger before anything else so the startup is logged
+    # using the configured level and outputs.
+    logging.Logger.setup(logging.LogLevels.getLevel(args.log_level), args.log_json,
+        args.log_rate_limit)
+
     # create a new minecraft server instance to initialize
     # the protocol factory on...
     server = MinecraftServer(args.backlog, args.address, args.port, args.name,
-        args.motd, args.software, args.public)
+        args.motd, args.software, args.public, args.tickrate,
+        args.view_radius, args.heartbeat_url, args.journal_interval,
+        args.world_format, args.max_worlds, args.world_idle_timeout,
+        args.level_compression, args.compression_threads, args.random_tick_speed,
+        args.send_buffer_limit)
 
     # initialize the minecraft server instance
     # which will also initilize any other utilities...
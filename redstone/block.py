@@ -4,46 +4,492 @@
  * Licensing information can found in 'LICENSE', which is part of this source code package.
 """
 
+import time
+import random
+import collections
+
 import redstone.util as util
+import redstone.chunk as chunk
 import redstone.packet as packet
 
 
 class BlockPhysicsManager(object):
+    """
+    Keeps a queue of the blocks which need their physics updated, a limited
+    number of them are updated each world tick
+    """
 
-    def __init__(self, world):
+    MAX_UPDATES_PER_TICK = 1000
+
+    # the block itself and the six blocks touching it.
+    NEIGHBOURS = ((0, 0, 0), (0, -1, 0), (0, 1, 0), (-1, 0, 0), (1, 0, 0), (0, 0, -1), (0, 0, 1))
+
+    def __init__(self, world, maxUpdates=MAX_UPDATES_PER_TICK):
         self._world = world
+        self._maxUpdates = maxUpdates
+
+        # the set holds the same positions as the queue, so a block is never
+        # queued more than once.
+        self._queue = collections.deque()
+        self._queued = set()
+
+        self._maxPending = 0
+        self._numUpdates = 0
+        self._updateStats = util.LatencyStats()
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+    @property
+    def maxPending(self):
+        return self._maxPending
+
+    @property
+    def numUpdates(self):
+        return self._numUpdates
+
+    @property
+    def updateStats(self):
+        return self._updateStats
 
     def hasPhysics(self, blockId):
         return blockId == util.BlockIds.SAND or blockId == util.BlockIds.GRAVEL
 
     def updateBlock(self, x, y, z, blockId):
-        if self.hasPhysics(blockId):
-            self.updateBlockPhysics(x, y, z, blockId)
+        # a block has changed, it and the blocks around it may have to move.
+        for dx, dy, dz in self.NEIGHBOURS:
+            self.scheduleUpdate(x + dx, y + dy, z + dz)
+
+    def scheduleUpdate(self, x, y, z):
+        position = (x, y, z)
+
+        if position in self._queued or not self._world.blockInRange(x, y, z):
+            return
+
+        if not self.hasPhysics(self._world.getBlock(x, y, z)):
+            return
+
+        self._queued.add(position)
+        self._queue.append(position)
+        self._maxPending = max(self._maxPending, len(self._queue))
+
+    def update(self):
+        if not self._queue:
+            return
+
+        startTime = time.time()
 
-    def updateBlockPhysics(self, x, y, z, blockId):
-        dy = y - 1
+        # blocks queued by the updates below wait for the next tick, so a
+        # tower of sand falls a block at a time instead of all at once.
+        numUpdates = min(len(self._queue), self._maxUpdates)
 
-        while self._world.getBlock(x, dy, z) == util.BlockIds.AIR:
-            self.broadcastBlockChange(x, dy, z, blockId)
+        for _ in xrange(numUpdates):
+            position = self._queue.popleft()
+            self._queued.discard(position)
+            self.updateBlockPhysics(*position)
 
-            if self._world.getBlock(x, dy + 1, z) == blockId:
-                self.broadcastBlockChange(x, dy + 1, z, util.BlockIds.AIR)
+        self._numUpdates += numUpdates
+        self._updateStats.record(time.time() - startTime)
 
+    def updateBlockPhysics(self, x, y, z):
+        blockId = self._world.getBlock(x, y, z)
+
+        if not self.hasPhysics(blockId):
+            return
+
+        dy = y
+
+        while dy > 0 and self._world.getBlock(x, dy - 1, z) == util.BlockIds.AIR:
             dy -= 1
-        else:
-            dy = y + 1
 
-            if not self._world.blockInRange(x, dy, z):
+        if dy == y:
+            return
+
+        self.broadcastBlockChange(x, y, z, util.BlockIds.AIR)
+        self.broadcastBlockChange(x, dy, z, blockId)
+
+    def broadcastBlockChange(self, x, y, z, blockId):
+        self._world.setBlock(x, y, z, blockId)
+        self._world.blockChangeQueue.queueChange(x, y, z, blockId)
+
+class BlockFluidManager(object):
+    """
+    Spreads flowing water and lava, only the cells which may still flow are
+    kept active and each fluid is only updated every few ticks
+    """
+
+    MAX_UPDATES_PER_TICK = 500
+
+    # the number of world ticks between each update of a fluid.
+    INTERVALS = {
+        util.BlockIds.FLOWING_WATER: 5,
+        util.BlockIds.FLOWING_LAVA: 30,
+    }
+
+    # fluids never flow upwards.
+    DIRECTIONS = ((0, -1, 0), (-1, 0, 0), (1, 0, 0), (0, 0, -1), (0, 0, 1))
+
+    # the blocks which could flow into a block.
+    NEIGHBOURS = ((0, 1, 0), (-1, 0, 0), (1, 0, 0), (0, 0, -1), (0, 0, 1))
+
+    def __init__(self, world, maxUpdates=MAX_UPDATES_PER_TICK):
+        self._world = world
+        self._maxUpdates = maxUpdates
+        self._ticks = 0
+
+        # the cells of each fluid to update on the fluid's next interval and
+        # the cells which are due but didn't fit in a tick's budget.
+        self._active = {blockId: set() for blockId in self.INTERVALS}
+        self._due = collections.deque()
+
+        self._numUpdates = 0
+        self._updateStats = util.LatencyStats()
+
+    @property
+    def numActive(self):
+        return sum([len(active) for active in self._active.values()]) + len(self._due)
+
+    @property
+    def numDue(self):
+        return len(self._due)
+
+    @property
+    def numUpdates(self):
+        return self._numUpdates
+
+    @property
+    def updateStats(self):
+        return self._updateStats
+
+    def isFluid(self, blockId):
+        return blockId in self.INTERVALS
+
+    def updateBlock(self, x, y, z, blockId):
+        if self.isFluid(blockId):
+            self._active[blockId].add((x, y, z))
+            return
+
+        # fluids only ever flow into air, so the fluid around a block only
+        # has to be woken up when the block is removed.
+        if blockId != util.BlockIds.AIR:
+            return
+
+        for dx, dy, dz in self.NEIGHBOURS:
+            self.activateBlock(x + dx, y + dy, z + dz)
+
+    def activateBlock(self, x, y, z):
+        if not self._world.blockInRange(x, y, z):
+            return
+
+        blockId = self._world.getBlock(x, y, z)
+
+        if self.isFluid(blockId):
+            self._active[blockId].add((x, y, z))
+
+    def update(self):
+        self._ticks += 1
+
+        for blockId, interval in self.INTERVALS.iteritems():
+            if self._ticks % interval or not self._active[blockId]:
+                continue
+
+            active, self._active[blockId] = self._active[blockId], set()
+            self._due.extend([(position, blockId) for position in active])
+
+        if not self._due:
+            return
+
+        startTime = time.time()
+        numUpdates = min(len(self._due), self._maxUpdates)
+
+        for _ in xrange(numUpdates):
+            position, blockId = self._due.popleft()
+            self.updateFluid(position, blockId)
+
+        self._numUpdates += numUpdates
+        self._updateStats.record(time.time() - startTime)
+
+    def updateFluid(self, position, blockId):
+        x, y, z = position
+
+        # the cell was replaced since it was activated.
+        if self._world.getBlock(x, y, z) != blockId:
+            return
+
+        # the fluid flows into every empty block next to and below it, those
+        # blocks become active through the world's block updates. a cell
+        # which can't flow anywhere is settled and isn't activated again
+        # until a block next to it changes.
+        for dx, dy, dz in self.DIRECTIONS:
+            nx, ny, nz = x + dx, y + dy, z + dz
+
+            if self._world.blockInRange(nx, ny, nz) and self._world.getBlock(nx, ny, nz) == util.BlockIds.AIR:
+                self.broadcastBlockChange(nx, ny, nz, blockId)
+
+    def broadcastBlockChange(self, x, y, z, blockId):
+        self._world.setBlock(x, y, z, blockId)
+        self._world.blockChangeQueue.queueChange(x, y, z, blockId)
+
+class BlockRandomTickManager(object):
+    """
+    Updates blocks picked at random every tick, this is how grass spreads
+    and dies and how saplings grow into trees
+    """
+
+    # blocks which let light through to the block below them.
+    TRANSPARENT = frozenset([util.BlockIds.AIR, util.BlockIds.SAPLING, util.BlockIds.LEAVES,
+        util.BlockIds.GLASS])
+
+    # the blocks next to a dirt block which grass can spread from.
+    SPREAD = tuple([(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1) if dx or dz])
+
+    MIN_TREE_HEIGHT = 4
+    MAX_TREE_HEIGHT = 6
+
+    def __init__(self, world):
+        self._world = world
+        self._rules = {
+            util.BlockIds.DIRT: self.updateDirt,
+            util.BlockIds.GRASS: self.updateGrass,
+            util.BlockIds.SAPLING: self.updateSapling,
+        }
+
+        # whether a block has to have light above it or not for it's rule to
+        # change it, dirt under dirt or grass under air never changes.
+        self._needsLight = {
+            util.BlockIds.DIRT: True,
+            util.BlockIds.GRASS: False,
+        }
+
+        self._numSamples = 0
+        self._numChanges = 0
+        self._updateStats = util.LatencyStats()
+
+    @property
+    def numSamples(self):
+        return self._numSamples
+
+    @property
+    def numChanges(self):
+        return self._numChanges
+
+    @property
+    def updateStats(self):
+        return self._updateStats
+
+    def update(self, samplesPerChunk):
+        if samplesPerChunk <= 0:
+            return
+
+        startTime = time.time()
+        blockData = self._world.blockData
+        chunks = blockData.chunks
+
+        # samples are drawn from the same random generator as the rules use,
+        # so seeding it replays the same ticks. each one is a block offset
+        # inside of a chunk.
+        getrandbits = random.getrandbits
+        offsetBits = chunk.CHUNK_SHIFT * 3
+
+        # chunks made of a single block which never changes on it's own, like
+        # air or stone, don't need to be sampled at all. in a chunk of dirt
+        # only the top layer isn't covered by more dirt.
+        uniformChunks = chunk.getUniformChunks()
+        topLayer = chunk.CHUNK_VOLUME - chunk.CHUNK_AREA
+
+        skippedChunks = set([id(uniformChunk) for blockId, uniformChunk in uniformChunks.iteritems() \
+            if blockId not in self._rules])
+
+        coveredChunks = set([id(uniformChunk) for blockId, uniformChunk in uniformChunks.iteritems() \
+            if self._needsLight.get(blockId)])
+
+        for index, blockChunk in enumerate(chunks):
+            if id(blockChunk) in skippedChunks:
+                continue
+
+            minOffset = topLayer if id(blockChunk) in coveredChunks else 0
+            origin = None
+
+            for _ in xrange(samplesPerChunk):
+                offset = getrandbits(offsetBits)
+
+                if offset < minOffset:
+                    continue
+
+                # the chunk is looked up again for every sample, a change made
+                # by a rule replaces the chunk with a copy.
+                blockChunk = chunks[index]
+
+                blockId = blockChunk[offset]
+                rule = self._rules.get(blockId)
+
+                if not rule:
+                    continue
+
+                # most samples are blocks which can't change because of what's
+                # above them, that's checked here if it's in the same chunk.
+                needsLight = self._needsLight.get(blockId)
+
+                if needsLight is not None and offset < topLayer and (blockChunk[offset + chunk.CHUNK_AREA] in \
+                    self.TRANSPARENT) != needsLight:
+
+                    continue
+
+                # the origin is only worked out for chunks with a sample left.
+                if origin is None:
+                    origin = blockData.getChunkOrigin(index)
+
+                x0, y0, z0 = origin
+                x = x0 + (offset & chunk.CHUNK_MASK)
+                y = y0 + (offset >> (chunk.CHUNK_SHIFT * 2))
+                z = z0 + ((offset >> chunk.CHUNK_SHIFT) & chunk.CHUNK_MASK)
+
+                # the chunks along the edges can reach outside of the world.
+                if self._world.blockInRange(x, y, z):
+                    rule(x, y, z)
+
+        self._numSamples += len(chunks) * samplesPerChunk
+        self._updateStats.record(time.time() - startTime)
+
+    def isLit(self, x, y, z):
+        return y + 1 >= self._world.height or self._world.getBlock(x, y + 1, z) in self.TRANSPARENT
+
+    def updateDirt(self, x, y, z):
+        if not self.isLit(x, y, z):
+            return
+
+        for dx, dy, dz in self.SPREAD:
+            if self._world.blockInRange(x + dx, y + dy, z + dz) and self._world.getBlock(
+                x + dx, y + dy, z + dz) == util.BlockIds.GRASS:
+
+                self.broadcastBlockChange(x, y, z, util.BlockIds.GRASS)
                 return
 
-            blockId = self._world.getBlock(x, dy, z)
+    def updateGrass(self, x, y, z):
+        if not self.isLit(x, y, z):
+            self.broadcastBlockChange(x, y, z, util.BlockIds.DIRT)
+
+    def updateSapling(self, x, y, z):
+        if y == 0 or self._world.getBlock(x, y - 1, z) not in (util.BlockIds.DIRT, util.BlockIds.GRASS):
+            return
 
-            if not self.hasPhysics(blockId):
+        height = random.randint(self.MIN_TREE_HEIGHT, self.MAX_TREE_HEIGHT)
+
+        # the tree only grows if there's room for it's trunk and the leaves
+        # on top of it.
+        if y + height >= self._world.height:
+            return
+
+        for trunkY in xrange(y + 1, y + height + 1):
+            if self._world.getBlock(x, trunkY, z) != util.BlockIds.AIR:
                 return
 
-            self.updateBlockPhysics(x, dy, z, blockId)
+        for leavesY in xrange(y + height - 3, y + height + 1):
+            radius = 2 if leavesY < y + height - 1 else 1
+
+            for leavesX in xrange(x - radius, x + radius + 1):
+                for leavesZ in xrange(z - radius, z + radius + 1):
+                    # round off the corners of the top of the tree.
+                    if radius == 1 and leavesY == y + height and leavesX != x and leavesZ != z:
+                        continue
+
+                    if self._world.blockInRange(leavesX, leavesY, leavesZ) and self._world.getBlock(
+                        leavesX, leavesY, leavesZ) == util.BlockIds.AIR:
+
+                        self.broadcastBlockChange(leavesX, leavesY, leavesZ, util.BlockIds.LEAVES)
+
+        for trunkY in xrange(y, y + height):
+            self.broadcastBlockChange(x, trunkY, z, util.BlockIds.LOG)
 
     def broadcastBlockChange(self, x, y, z, blockId):
-        self._world.setBlock(x, y, z, blockId, False)
-        self._world.worldManager.factory.broadcast(packet.SetBlockServer.DIRECTION,
-            packet.SetBlockServer.ID, [], x, y, z, blockId)
+        self._world.setBlock(x, y, z, blockId)
+        self._world.blockChangeQueue.queueChange(x, y, z, blockId)
+        self._numChanges += 1
+
+class BlockChangeQueue(object):
+    """
+    Collects the block changes made in a world during a tick and sends
+    them to every player in the world as one write per player
+    """
+
+    def __init__(self, world):
+        self._world = world
+        self._changes = {}
+
+        self._lastBatchSize = 0
+        self._maxBatchSize = 0
+        self._numBatches = 0
+        self._numChanges = 0
+        self._numCoalesced = 0
+
+    @property
+    def pending(self):
+        return len(self._changes)
+
+    @property
+    def lastBatchSize(self):
+        return self._lastBatchSize
+
+    @property
+    def maxBatchSize(self):
+        return self._maxBatchSize
+
+    @property
+    def averageBatchSize(self):
+        return float(self._numChanges) / self._numBatches if self._numBatches else 0.0
+
+    @property
+    def numBatches(self):
+        return self._numBatches
+
+    @property
+    def numChanges(self):
+        return self._numChanges
+
+    @property
+    def numCoalesced(self):
+        return self._numCoalesced
+
+    def queueChange(self, x, y, z, blockId, origin=None):
+        # only the last change to a block within a tick is sent, the origin
+        # is the protocol that made the change and already knows about it.
+        position = (x, y, z)
+
+        if position in self._changes:
+            self._numCoalesced += 1
+
+        self._changes[position] = (blockId, origin)
+
+    def flush(self):
+        if not self._changes:
+            return
+
+        changes, self._changes = self._changes, {}
+
+        encodedChanges = [(packet.SetBlockServer.encode(x, y, z, blockId), origin) for (x, y, z), (blockId, origin) in \
+            changes.iteritems()]
+
+        data = ''.join([encodedChange for encodedChange, _ in encodedChanges])
+        origins = set([origin for _, origin in encodedChanges if origin])
+
+        for protocol in self._world.protocols:
+            # players still loading the level are sent what changed once
+            # they've finished loading it.
+            if not protocol.entity or not protocol.entity.spawned:
+                continue
+
+            if protocol not in origins:
+                protocol.dispatcher.handleWrite(data)
+                continue
+
+            otherData = ''.join([encodedChange for encodedChange, origin in encodedChanges \
+                if origin is not protocol])
+
+            if otherData:
+                protocol.dispatcher.handleWrite(otherData)
+
+        self._lastBatchSize = len(changes)
+        self._maxBatchSize = max(self._maxBatchSize, self._lastBatchSize)
+        self._numBatches += 1
+        self._numChanges += self._lastBatchSize
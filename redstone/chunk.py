@@ -0,0 +1,248 @@
+"""
+ * Copyright (C) Caleb Marshall - All Rights Reserved
+ * Written by Caleb Marshall <anythingtechpro@gmail.com>, April 23rd, 2017
+ * Licensing information can found in 'LICENSE', which is part of this source code package.
+"""
+
+CHUNK_SHIFT = 4
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+CHUNK_AREA = CHUNK_SIZE * CHUNK_SIZE
+CHUNK_VOLUME = CHUNK_AREA * CHUNK_SIZE
+
+_uniformChunks = {}
+
+def getUniformChunk(blockId):
+    # chunks made of a single block are shared by every store, they must
+    # never be written to directly.
+    chunk = _uniformChunks.get(blockId)
+
+    if chunk is None:
+        chunk = _uniformChunks[blockId] = bytearray(chr(blockId) * CHUNK_VOLUME)
+
+    return chunk
+
+def getUniformChunks():
+    # returns every shared chunk created so far, by the block it's made of.
+    return dict(_uniformChunks)
+
+def getUniformBlock(chunk):
+    # returns the block id a chunk is made of or None if it has more than one.
+    blockId = chunk[0]
+
+    if chunk == getUniformChunk(blockId):
+        return blockId
+
+    return None
+
+class ChunkStore(object):
+    """
+    Block data split into 16x16x16 chunks, chunks are shared between each
+    other and with snapshots of the store until they're first written to
+    """
+
+    def __init__(self, width, height, depth, chunks=None):
+        self._width = width
+        self._height = height
+        self._depth = depth
+        self._chunksX = ((width - 1) >> CHUNK_SHIFT) + 1
+        self._chunksY = ((height - 1) >> CHUNK_SHIFT) + 1
+        self._chunksZ = ((depth - 1) >> CHUNK_SHIFT) + 1
+        self._chunks = chunks if chunks else [getUniformChunk(0)] * self.numChunks
+
+        # one byte per chunk, set once the store has its own copy of the chunk.
+        self._owned = bytearray(self.numChunks)
+
+    @property
+    def width(self):
+        return self._width
+
+    @property
+    def height(self):
+        return self._height
+
+    @property
+    def depth(self):
+        return self._depth
+
+    @property
+    def volume(self):
+        return self._width * self._height * self._depth
+
+    @property
+    def numChunks(self):
+        return self._chunksX * self._chunksY * self._chunksZ
+
+    @property
+    def numOwnedChunks(self):
+        return self._owned.count('\x01')
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+    def getChunkIndex(self, x, y, z):
+        return (x >> CHUNK_SHIFT) + self._chunksX * ((z >> CHUNK_SHIFT) + self._chunksZ * (y >> CHUNK_SHIFT))
+
+    def getChunk(self, index):
+        return self._chunks[index]
+
+    def getChunkOrigin(self, index):
+        # returns the position of the lowest block in the chunk.
+        return ((index % self._chunksX) << CHUNK_SHIFT, (index // (self._chunksX * self._chunksZ)) << CHUNK_SHIFT,
+            ((index // self._chunksX) % self._chunksZ) << CHUNK_SHIFT)
+
+    def setChunk(self, index, data):
+        chunk = bytearray(data)
+        blockId = getUniformBlock(chunk)
+
+        if blockId is not None:
+            self._chunks[index] = getUniformChunk(blockId)
+            self._owned[index] = 0
+        else:
+            self._chunks[index] = chunk
+            self._owned[index] = 1
+
+    def fillChunkLayer(self, cy, data):
+        # every chunk in the layer shares the same chunk until it's written.
+        chunk = bytearray(data)
+        blockId = getUniformBlock(chunk)
+
+        if blockId is not None:
+            chunk = getUniformChunk(blockId)
+
+        start = self._chunksX * self._chunksZ * cy
+        end = start + self._chunksX * self._chunksZ
+
+        self._chunks[start:end] = [chunk] * (end - start)
+        self._owned[start:end] = bytearray(end - start)
+
+    def getBlock(self, x, y, z):
+        return self._chunks[(x >> CHUNK_SHIFT) + self._chunksX * ((z >> CHUNK_SHIFT) + self._chunksZ * (
+            y >> CHUNK_SHIFT))][(x & CHUNK_MASK) | ((z & CHUNK_MASK) << CHUNK_SHIFT) | (
+                (y & CHUNK_MASK) << (CHUNK_SHIFT * 2))]
+
+    def setBlock(self, x, y, z, blockId):
+        index = (x >> CHUNK_SHIFT) + self._chunksX * ((z >> CHUNK_SHIFT) + self._chunksZ * (y >> CHUNK_SHIFT))
+
+        # copy the chunk the first time it's written to, it may be shared.
+        if not self._owned[index]:
+            self._chunks[index] = bytearray(self._chunks[index])
+            self._owned[index] = 1
+
+        self._chunks[index][(x & CHUNK_MASK) | ((z & CHUNK_MASK) << CHUNK_SHIFT) | (
+            (y & CHUNK_MASK) << (CHUNK_SHIFT * 2))] = blockId
+
+        return index
+
+    def snapshot(self):
+        # the snapshot shares every chunk, so the store gives up ownership
+        # and copies a chunk again before it writes to it next.
+        self._owned[:] = bytearray(self.numChunks)
+        return ChunkStore(self._width, self._height, self._depth, list(self._chunks))
+
+    def iterChanges(self, other):
+        """
+        Yields a list of (x, y, z, blockId) for every chunk with blocks which
+        are different in the other store, only chunks which aren't shared
+        have to be compared
+        """
+
+        for index in xrange(self.numChunks):
+            chunk, otherChunk = self._chunks[index], other._chunks[index]
+
+            if chunk is otherChunk or chunk == otherChunk:
+                continue
+
+            x0, y0, z0 = self.getChunkOrigin(index)
+
+            changes = []
+
+            for offset in self.__iterChangedOffsets(chunk, otherChunk):
+                x = x0 + (offset & CHUNK_MASK)
+                z = z0 + ((offset >> CHUNK_SHIFT) & CHUNK_MASK)
+                y = y0 + (offset >> (CHUNK_SHIFT * 2))
+
+                if x < self._width and y < self._height and z < self._depth:
+                    changes.append((x, y, z, otherChunk[offset]))
+
+            yield changes
+
+    def __iterChangedOffsets(self, chunk, otherChunk):
+        # narrow the changes down a layer and then a row at a time, equal
+        # slices are compared in C so only the rows that changed are
+        # compared a block at a time.
+        for layer in xrange(0, CHUNK_VOLUME, CHUNK_AREA):
+            if chunk[layer:layer + CHUNK_AREA] == otherChunk[layer:layer + CHUNK_AREA]:
+                continue
+
+            for row in xrange(layer, layer + CHUNK_AREA, CHUNK_SIZE):
+                if chunk[row:row + CHUNK_SIZE] == otherChunk[row:row + CHUNK_SIZE]:
+                    continue
+
+                for offset in xrange(row, row + CHUNK_SIZE):
+                    if chunk[offset] != otherChunk[offset]:
+                        yield offset
+
+    def iterBlockData(self):
+        """
+        Yields the blocks in the order of the classic protocol, x first then
+        z then y, a whole layer of blocks at a time
+        """
+
+        rowLength = self._chunksX << CHUNK_SHIFT
+
+        for cy in xrange(self._chunksY):
+            # neighbouring chunks which are the same chunk are joined into a
+            # single run, so untouched parts of a row are copied all at once.
+            chunkRows = []
+
+            for cz in xrange(self._chunksZ):
+                start = self._chunksX * (cz + self._chunksZ * cy)
+                runs = []
+
+                for chunk in self._chunks[start:start + self._chunksX]:
+                    if runs and runs[-1][0] is chunk:
+                        runs[-1][1] += 1
+                    else:
+                        runs.append([chunk, 1])
+
+                chunkRows.append((runs, min(CHUNK_SIZE, self._depth - (cz << CHUNK_SHIFT))))
+
+            for ly in xrange(min(CHUNK_SIZE, self._height - (cy << CHUNK_SHIFT))):
+                rows = []
+
+                for runs, numRows in chunkRows:
+                    for lz in xrange(numRows):
+                        offset = (ly << (CHUNK_SHIFT * 2)) | (lz << CHUNK_SHIFT)
+                        row = bytearray().join([chunk[offset:offset + CHUNK_SIZE] * count for chunk, count in runs])
+
+                        rows.append(row if rowLength == self._width else row[:self._width])
+
+                yield bytes(bytearray().join(rows))
+
+    def toBytes(self):
+        return bytes().join(self.iterBlockData())
+
+    @classmethod
+    def fromBytes(cls, width, height, depth, data):
+        # split blocks in the order of the classic protocol into chunks.
+        store = cls(width, height, depth)
+        chunk = bytearray(CHUNK_VOLUME)
+
+        for cy in xrange(store._chunksY):
+            for cz in xrange(store._chunksZ):
+                for cx in xrange(store._chunksX):
+                    x0 = cx << CHUNK_SHIFT
+                    length = min(CHUNK_SIZE, width - x0)
+                    chunk[:] = bytearray(CHUNK_VOLUME)
+
+                    for ly in xrange(min(CHUNK_SIZE, height - (cy << CHUNK_SHIFT))):
+                        for lz in xrange(min(CHUNK_SIZE, depth - (cz << CHUNK_SHIFT))):
+                            offset = x0 + width * ((cz << CHUNK_SHIFT) + lz + depth * ((cy << CHUNK_SHIFT) + ly))
+                            chunkOffset = (ly << (CHUNK_SHIFT * 2)) | (lz << CHUNK_SHIFT)
+                            chunk[chunkOffset:chunkOffset + length] = data[offset:offset + length]
+
+                    store.setChunk(store.getChunkIndex(x0, cy << CHUNK_SHIFT, cz << CHUNK_SHIFT), chunk)
+
+        return store
@@ -4,6 +4,8 @@
  * Licensing information can found in 'LICENSE', which is part of this source code package.
 """
 
+from twisted.internet import defer
+
 import redstone.logging as logging
 import redstone.util as util
 import redstone.packet as packet
@@ -25,9 +27,20 @@ class CommandSerializer(object):
     def serialize(self, *args, **kw):
         return None
 
-    def serializeDone(self):
+    def serializeDone(self, *args, **kw):
         pass
 
+    def notify(self, message):
+        # sends a message to the player that ran the command, used to report
+        # back on commands that finish after they have returned.
+        entity = self._protocol.entity
+
+        if not entity or not self._protocol.transport.connected:
+            return
+
+        self._protocol.dispatcher.handleDispatch(packet.ServerMessage.DIRECTION, packet.ServerMessage.ID,
+            entity.id, message)
+
 class CommandMute(CommandSerializer):
     KEYWORD = 'mute'
     PERMISSION = util.PlayerRanks.ADMINISTRATOR
@@ -119,7 +132,10 @@ class CommandGoto(CommandSerializer):
         if currentWorld.name == targetWorld.name:
             return 'You cannot teleport to a world you\'re already in!'
 
-        self._protocol.dispatcher.handleDispatch(protocol.ServerIdentification.DIRECTION, protocol.ServerIdentification.ID,
+        if targetWorld.isFull():
+            return 'Failed to teleport to world, %s is full!' % world
+
+        self._protocol.dispatcher.handleDispatch(packet.ServerIdentification.DIRECTION, packet.ServerIdentification.ID,
             entity.username, entity=entity, worldName=targetWorld.name)
 
         return 'Successfully teleported %s to world %s' % (entity.username, targetWorld.name)
@@ -130,10 +146,18 @@ class CommandSaveAll(CommandSerializer):
     DESCRIPTION = 'Saves all worlds.'
 
     def serialize(self):
-        for world in self._protocol.factory.worldManager.worlds.values():
-            world.save()
+        deferreds = [world.save() for world in self._protocol.factory.worldManager.worlds.values()]
+
+        deferred = defer.DeferredList(deferreds, consumeErrors=True)
+        deferred.addCallback(self.serializeDone)
+
+        return 'Saving all worlds...'
 
-        return 'Successfully saved all worlds.'
+    def serializeDone(self, results):
+        if all([success for success, _ in results]):
+            self.notify('Successfully saved all worlds.')
+        else:
+            self.notify('Failed to save all worlds!')
 
 class CommandSave(CommandSerializer):
     KEYWORD = 'save'
@@ -151,8 +175,16 @@ class CommandSave(CommandSerializer):
         if not world:
             return 'Failed to save world!'
 
-        world.save()
-        return 'Successfully saved world %s.' % world.name
+        deferred = world.save()
+        deferred.addCallbacks(self.serializeDone, self.serializeFailed)
+
+        return 'Saving world %s...' % world.name
+
+    def serializeDone(self, world):
+        self.notify('Successfully saved world %s.' % world.name)
+
+    def serializeFailed(self, failure):
+        self.notify('Failed to save world!')
 
 class CommandTeleport(CommandSerializer):
     KEYWORD = 'tp'
@@ -176,8 +208,14 @@ class CommandTeleport(CommandSerializer):
         senderEntity.y = targetEntity.y
         senderEntity.z = targetEntity.z
 
-        self._protocol.factory.broadcast(packet.PositionAndOrientationStatic.DIRECTION, packet.PositionAndOrientationStatic.ID, [], senderEntity.id, senderEntity.x,
-            senderEntity.y, senderEntity.z, senderEntity.yaw, senderEntity.pitch)
+        self._protocol.dispatcher.handleDispatch(packet.PositionAndOrientationStatic.DIRECTION, packet.PositionAndOrientationStatic.ID, senderEntity.id,
+            senderEntity.x, senderEntity.y, senderEntity.z, senderEntity.yaw, senderEntity.pitch)
+
+        # the players that can see the sender are updated on the next world tick.
+        senderWorld = self._protocol.factory.worldManager.getWorld(senderEntity.world)
+
+        if senderWorld:
+            senderWorld.movementManager.markDirty(senderEntity)
 
         return 'Successfully teleported %s to %s.' % (senderEntity.username, targetEntity.username)
 
@@ -189,14 +227,8 @@ class CommandList(CommandSerializer):
     def serialize(self, listType):
 
         def getPlayers():
-            numPlayerOnline = 0
-
-            for world in self._protocol.factory.worldManager.worlds.values():
-                for entity in world.entityManager.entities.values():
-                    if entity.isPlayer():
-                        numPlayerOnline += 1
-
-            return 'There are currently %d players online.' % numPlayerOnline
+            return 'There are currently %d players online.' % (
+                self._protocol.factory.worldManager.getNumPlayers())
 
         def getWorlds():
             worlds = []
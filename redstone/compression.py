@@ -0,0 +1,113 @@
+"""
+ * Copyright (C) Caleb Marshall - All Rights Reserved
+ * Written by Caleb Marshall <anythingtechpro@gmail.com>, April 23rd, 2017
+ * Licensing information can found in 'LICENSE', which is part of this source code package.
+"""
+
+import struct
+import zlib
+import threading
+import collections
+
+from multiprocessing.pool import ThreadPool
+
+
+def compressBlock(data, compresslevel):
+    # each block is compressed on it's own as raw deflate data, the sync
+    # flush ends it on a byte boundary so the blocks can simply be joined.
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+class ParallelGzipCompressor(object):
+    """
+    Compresses data into a single gzip stream by splitting it into blocks
+    which are compressed at the same time by a pool of worker threads
+    """
+
+    BLOCK_SIZE = 128 * 1024
+
+    HEADER = struct.Struct('<2sBBIBB')
+    TRAILER = struct.Struct('<II')
+
+    def __init__(self, numWorkers, blockSize=BLOCK_SIZE):
+        self._numWorkers = numWorkers
+        self._blockSize = blockSize
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def numWorkers(self):
+        return self._numWorkers
+
+    @property
+    def blockSize(self):
+        return self._blockSize
+
+    def getPool(self):
+        # the pool is only started the first time something is compressed.
+        with self._lock:
+            if not self._pool and self._numWorkers > 1:
+                self._pool = ThreadPool(self._numWorkers)
+
+            return self._pool
+
+    def iterBlocks(self, pieces):
+        pending = bytearray()
+
+        for piece in pieces:
+            pending += piece
+
+            while len(pending) >= self._blockSize:
+                yield bytes(pending[:self._blockSize])
+                del pending[:self._blockSize]
+
+        if pending:
+            yield bytes(pending)
+
+    def compress(self, pieces, compresslevel=9):
+        """
+        Compresses an iterable of strings and returns the gzip data, the
+        pieces are read lazily so only a few blocks are held uncompressed
+        """
+
+        pool = self.getPool()
+
+        if not pool:
+            compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            return bytes().join([compressor.compress(piece) for piece in pieces] + [compressor.flush()])
+
+        extraFlags = 2 if compresslevel == 9 else (4 if compresslevel == 1 else 0)
+        data = [self.HEADER.pack('\x1f\x8b', zlib.DEFLATED, 0, 0, extraFlags, 255)]
+
+        crc = 0
+        size = 0
+
+        # zlib releases the gil while it compresses, so the workers run in
+        # parallel. a few blocks per worker are queued to keep them busy.
+        results = collections.deque()
+
+        for block in self.iterBlocks(pieces):
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+
+            results.append(pool.apply_async(compressBlock, (block, compresslevel)))
+
+            if len(results) >= self._numWorkers * 2:
+                data.append(results.popleft().get())
+
+        while results:
+            data.append(results.popleft().get())
+
+        # an empty final block ends the deflate stream.
+        data.append(zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS).flush())
+        data.append(self.TRAILER.pack(crc & 0xffffffff, size & 0xffffffff))
+
+        return bytes().join(data)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+
+        if pool:
+            pool.close()
+            pool.join()
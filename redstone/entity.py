@@ -4,64 +4,267 @@
  * Licensing information can found in 'LICENSE', which is part of this source code package.
 """
 
+import array
+import heapq
+import itertools
+import collections
+
 import redstone.util as util
+import redstone.packet as packet
+
+
+class EntityMovement(object):
+    TELEPORT = 0
+    MOVE_AND_ROTATE = 1
+    MOVE = 2
+    ROTATE = 3
+
+class EntityStateTable(object):
+    """
+    The position of every entity in a world kept in one array per field,
+    an entity is a row in the table so a tick can work on all of them at once
+    """
+
+    def __init__(self):
+        self._x = array.array('d')
+        self._y = array.array('d')
+        self._z = array.array('d')
+        self._yaw = array.array('B')
+        self._pitch = array.array('B')
+
+        # the fixed point position the players were last sent, the row's
+        # flag is cleared until a position has been sent.
+        self._sentX = array.array('i')
+        self._sentY = array.array('i')
+        self._sentZ = array.array('i')
+        self._sentYaw = array.array('B')
+        self._sentPitch = array.array('B')
+        self._hasSent = bytearray()
+
+        self._entities = []
+        self._freeRows = collections.deque()
+
+    @property
+    def x(self):
+        return self._x
+
+    @property
+    def y(self):
+        return self._y
+
+    @property
+    def z(self):
+        return self._z
+
+    @property
+    def yaw(self):
+        return self._yaw
+
+    @property
+    def pitch(self):
+        return self._pitch
+
+    @property
+    def numRows(self):
+        return len(self._entities)
+
+    @property
+    def numEntities(self):
+        return len(self._entities) - len(self._freeRows)
+
+    def allocate(self, entity):
+        if self._freeRows:
+            row = self._freeRows.popleft()
+            self._entities[row] = entity
+            return row
+
+        # the table grows by one row, rows are reused once they're freed.
+        for field in (self._x, self._y, self._z, self._yaw, self._pitch, self._sentX, self._sentY,
+            self._sentZ, self._sentYaw, self._sentPitch):
+
+            field.append(0)
+
+        self._hasSent.append(0)
+        self._entities.append(entity)
+        return len(self._entities) - 1
+
+    def free(self, row):
+        self._entities[row] = None
+        self._hasSent[row] = 0
+        self._freeRows.append(row)
+
+    def copyRow(self, row, otherTable, otherRow):
+        for field, otherField in zip(self.getFields(), otherTable.getFields()):
+            field[row] = otherField[otherRow]
+
+    def getFields(self):
+        return (self._x, self._y, self._z, self._yaw, self._pitch, self._sentX, self._sentY, self._sentZ,
+            self._sentYaw, self._sentPitch, self._hasSent)
+
+    def getFixedPosition(self, row):
+        # positions are sent as fixed point values, 32 units per block.
+        return (int(round(self._x[row] * 32.0)), int(round(self._y[row] * 32.0)), int(round(self._z[row] * 32.0)),
+            self._yaw[row], self._pitch[row])
+
+    def getSentPosition(self, row):
+        if not self._hasSent[row]:
+            return None
+
+        return (self._sentX[row], self._sentY[row], self._sentZ[row], self._sentYaw[row], self._sentPitch[row])
+
+    def setSentPosition(self, row, sentPosition):
+        if sentPosition is None:
+            self._hasSent[row] = 0
+            return
+
+        self._sentX[row], self._sentY[row], self._sentZ[row], self._sentYaw[row], self._sentPitch[row] = \
+            sentPosition
+
+        self._hasSent[row] = 1
+
+    def updateMovement(self, rows):
+        """
+        Works out how each row has moved since it's position was last sent
+        and marks the new position as sent, returns (row, movement, changeX,
+        changeY, changeZ) for every row which has moved or rotated
+        """
+
+        x, y, z, yaw, pitch = self._x, self._y, self._z, self._yaw, self._pitch
+        sentX, sentY, sentZ, sentYaw, sentPitch = self._sentX, self._sentY, self._sentZ, self._sentYaw, \
+            self._sentPitch
+
+        hasSent = self._hasSent
+        movements = []
+        roundValue = round
 
+        for row in rows:
+            fixedX, fixedY, fixedZ = int(roundValue(x[row] * 32.0)), int(roundValue(y[row] * 32.0)), \
+                int(roundValue(z[row] * 32.0))
+
+            if not hasSent[row]:
+                sentX[row], sentY[row], sentZ[row] = fixedX, fixedY, fixedZ
+                sentYaw[row], sentPitch[row] = yaw[row], pitch[row]
+                hasSent[row] = 1
+                continue
+
+            changeX, changeY, changeZ = fixedX - sentX[row], fixedY - sentY[row], fixedZ - sentZ[row]
+            moved = changeX or changeY or changeZ
+            rotated = yaw[row] != sentYaw[row] or pitch[row] != sentPitch[row]
+
+            if not moved and not rotated:
+                continue
+
+            sentX[row], sentY[row], sentZ[row] = fixedX, fixedY, fixedZ
+            sentYaw[row], sentPitch[row] = yaw[row], pitch[row]
+
+            # relative movement only fits in a signed byte per axis.
+            if moved and not (-128 <= changeX <= 127 and -128 <= changeY <= 127 and -128 <= changeZ <= 127):
+                movement = EntityMovement.TELEPORT
+            elif moved and rotated:
+                movement = EntityMovement.MOVE_AND_ROTATE
+            elif moved:
+                movement = EntityMovement.MOVE
+            else:
+                movement = EntityMovement.ROTATE
+
+            movements.append((row, movement, changeX, changeY, changeZ))
+
+        return movements
+
+    def getDistancesSquared(self, x, z, rows):
+        # returns the squared distance from the point to each row along the x and z axis.
+        tableX, tableZ = self._x, self._z
+        return [(tableX[row] - x) ** 2 + (tableZ[row] - z) ** 2 for row in rows]
+
+    def getEntitiesInRange(self, x, z, radius):
+        # scans every row of the table at once.
+        radiusSquared = radius * radius
+
+        return [entity for entity, entityX, entityZ in itertools.izip(self._entities, self._x, self._z) \
+            if entity and (entityX - x) ** 2 + (entityZ - z) ** 2 <= radiusSquared]
+
+    def getEntity(self, row):
+        return self._entities[row]
 
 class Entity(object):
+    """
+    An entity in a world, it's position is a row in an entity state table
+    which is owned by the entity manager of the world the entity is in
+    """
 
     def __init__(self, protocol=None):
         self._protocol = protocol
         self._id = 0
-        self._x = 0
-        self._y = 0
-        self._z = 0
-        self._yaw = 0
-        self._pitch = 0
         self._world = ''
+        self._spawned = False
+        self._visibleEntities = set()
+
+        # until the entity is added to a world it has a table of it's own.
+        self._table = EntityStateTable()
+        self._row = self._table.allocate(self)
 
     @property
     def protocol(self):
         return self._protocol
 
+    @property
+    def table(self):
+        return self._table
+
+    @property
+    def row(self):
+        return self._row
+
+    def attach(self, table):
+        # move the entity's state to a row in another table.
+        row = table.allocate(self)
+        table.copyRow(row, self._table, self._row)
+
+        self._table.free(self._row)
+        self._table, self._row = table, row
+
+    def detach(self):
+        self.attach(EntityStateTable())
+
     @property
     def x(self):
-        return self._x
+        return self._table.x[self._row]
 
     @x.setter
     def x(self, x):
-        self._x = x
+        self._table.x[self._row] = x
 
     @property
     def y(self):
-        return self._y
+        return self._table.y[self._row]
 
     @y.setter
     def y(self, y):
-        self._y = y
+        self._table.y[self._row] = y
 
     @property
     def z(self):
-        return self._z
+        return self._table.z[self._row]
 
     @z.setter
     def z(self, z):
-        self._z = z
+        self._table.z[self._row] = z
 
     @property
     def yaw(self):
-        return self._yaw
+        return self._table.yaw[self._row]
 
     @yaw.setter
     def yaw(self, yaw):
-        self._yaw = yaw
+        self._table.yaw[self._row] = yaw
 
     @property
     def pitch(self):
-        return self._pitch
+        return self._table.pitch[self._row]
 
     @pitch.setter
     def pitch(self, pitch):
-        self._pitch = pitch
+        self._table.pitch[self._row] = pitch
 
     @property
     def world(self):
@@ -71,6 +274,32 @@ class Entity(object):
     def world(self, world):
         self._world = world
 
+    @property
+    def sentPosition(self):
+        return self._table.getSentPosition(self._row)
+
+    @sentPosition.setter
+    def sentPosition(self, sentPosition):
+        self._table.setSentPosition(self._row, sentPosition)
+
+    @property
+    def spawned(self):
+        return self._spawned
+
+    @spawned.setter
+    def spawned(self, spawned):
+        self._spawned = spawned
+
+    @property
+    def visibleEntities(self):
+        return self._visibleEntities
+
+    def getDistanceSquared(self, x, z):
+        return (self._table.x[self._row] - x) ** 2 + (self._table.z[self._row] - z) ** 2
+
+    def getFixedPosition(self):
+        return self._table.getFixedPosition(self._row)
+
     def isPlayer(self):
         return False
 
@@ -111,29 +340,117 @@ class PlayerEntity(Entity):
         return True
 
 class UniqueIdAllocator(object):
+    """
+    Hands out ids from a heap of free ids, the lowest free id is always
+    handed out first so ids stay small
+    """
+
+    # player ids are sent as signed bytes and -1 is the player themselves.
+    MAX_IDS = 128
+
+    def __init__(self, maxIds=MAX_IDS):
+        self._maxIds = min(maxIds, self.MAX_IDS)
+        self._freeIds = range(self._maxIds)
+        self._allocated = bytearray(self._maxIds)
 
-    def __init__(self, maxIds=255):
-        self._ids = {id: False for id in xrange(maxIds)}
+    @property
+    def maxIds(self):
+        return self._maxIds
+
+    @property
+    def numAllocated(self):
+        return self._maxIds - len(self._freeIds)
+
+    @property
+    def full(self):
+        return not self._freeIds
 
     def allocate(self):
-        for id in self._ids:
-            if self._ids[id]:
-                continue
+        if not self._freeIds:
+            return None
 
-            self._ids[id] = True
-            return id
+        id = heapq.heappop(self._freeIds)
+        self._allocated[id] = 1
+        return id
 
     def deallocate(self, id):
-        if id not in self._ids:
+        if id is None or not 0 <= id < self._maxIds or not self._allocated[id]:
+            return
+
+        self._allocated[id] = 0
+        heapq.heappush(self._freeIds, id)
+
+class SpatialGrid(object):
+    """
+    A uniform grid over the x and z axis which buckets entities
+    by the cell they are standing in
+    """
+
+    def __init__(self, cellSize):
+        self._cellSize = cellSize
+        self._cells = {}
+        self._entityCells = {}
+
+    @property
+    def cellSize(self):
+        return self._cellSize
+
+    def getCell(self, x, z):
+        return (int(x // self._cellSize), int(z // self._cellSize))
+
+    def getNumCells(self, x, z, radius):
+        # the number of cells a query of the radius has to look at.
+        minX, minZ = self.getCell(x - radius, z - radius)
+        maxX, maxZ = self.getCell(x + radius, z + radius)
+
+        return (maxX - minX + 1) * (maxZ - minZ + 1)
+
+    def insert(self, entity):
+        cell = self.getCell(entity.x, entity.z)
+        self._cells.setdefault(cell, set()).add(entity)
+        self._entityCells[entity] = cell
+
+    def remove(self, entity):
+        cell = self._entityCells.pop(entity, None)
+
+        if cell is None:
             return
 
-        self._ids[id] = False
+        entities = self._cells[cell]
+        entities.discard(entity)
+
+        if not entities:
+            del self._cells[cell]
+
+    def update(self, entity):
+        if self._entityCells.get(entity) == self.getCell(entity.x, entity.z):
+            return
+
+        self.remove(entity)
+        self.insert(entity)
+
+    def query(self, x, z, radius):
+        # returns the entities in every cell the radius touches, some of
+        # them may still be further away than the radius.
+        minX, minZ = self.getCell(x - radius, z - radius)
+        maxX, maxZ = self.getCell(x + radius, z + radius)
+        entities = []
+
+        for cellX in xrange(minX, maxX + 1):
+            for cellZ in xrange(minZ, maxZ + 1):
+                entities.extend(self._cells.get((cellX, cellZ), ()))
+
+        return entities
 
 class EntityManager(object):
+    CELL_SIZE = 16
 
-    def __init__(self):
+    def __init__(self, viewRadius):
         self._allocator = UniqueIdAllocator()
         self._entities = {}
+        self._viewRadius = viewRadius
+        self._grid = SpatialGrid(self.CELL_SIZE)
+        self._table = EntityStateTable()
 
     @property
     def allocator(self):
@@ -143,20 +460,181 @@ class EntityManager(object):
     def entities(self):
         return self._entities
 
+    @property
+    def viewRadius(self):
+        return self._viewRadius
+
+    @property
+    def grid(self):
+        return self._grid
+
+    @property
+    def table(self):
+        return self._table
+
     def addEntity(self, entity):
         if entity.id in self._entities:
             return
 
         self._entities[entity.id] = entity
+        entity.attach(self._table)
+        self._grid.insert(entity)
 
     def removeEntity(self, entity):
         if entity.id not in self._entities:
             return
 
         del self._entities[entity.id]
+        self._grid.remove(entity)
+        entity.detach()
+
+    def moveEntity(self, entity):
+        self._grid.update(entity)
+
+    def getEntitiesInRange(self, x, z, radius=None):
+        radius = self._viewRadius if radius is None else radius
+
+        # once there are fewer entities than grid cells to look at it's
+        # cheaper to scan the whole table than to visit every cell.
+        if self._table.numEntities < self._grid.getNumCells(x, z, radius):
+            return self._table.getEntitiesInRange(x, z, radius)
+
+        entities = self._grid.query(x, z, radius)
+
+        # the distances of every candidate are worked out in one go from the table.
+        distances = self._table.getDistancesSquared(x, z, [entity.row for entity in entities])
+        return [entity for entity, distance in itertools.izip(entities, distances) if distance <= radius * radius]
 
     def hasEntity(self, entityId):
         return entityId in self._entities
 
     def getEntity(self, entityId):
         return self._entities.get(entityId)
+
+class EntityMovementManager(object):
+    # entities have to move this much further than the view radius before
+    # they are despawned, so they don't flicker in and out at the edge.
+    VIEW_MARGIN = 8
+
+    def __init__(self, world):
+        self._world = world
+        self._dirtyEntities = set()
+
+    def markDirty(self, entity):
+        self._dirtyEntities.add(entity)
+
+    def resetEntity(self, entity):
+        # the entity's current position was just sent in full, the
+        # next movement update is relative to it.
+        entity.sentPosition = entity.getFixedPosition()
+
+    def removeEntity(self, entity):
+        self._dirtyEntities.discard(entity)
+
+        for otherEntity in list(entity.visibleEntities):
+            self.hideEntities(entity, otherEntity)
+
+        entity.spawned = False
+
+    def update(self):
+        if not self._dirtyEntities:
+            return
+
+        dirtyEntities, self._dirtyEntities = self._dirtyEntities, set()
+        entityManager = self._world.entityManager
+
+        dirtyEntities = [entity for entity in dirtyEntities if entityManager.getEntity(
+            entity.id) is entity]
+
+        # first send the movement to everyone who can already see the entity,
+        # after which every entity's sent position matches it's real position.
+        # the movement of every entity is worked out in one pass over the table.
+        table = entityManager.table
+
+        for row, movement, changeX, changeY, changeZ in table.updateMovement([entity.row for entity in \
+            dirtyEntities]):
+
+            self.broadcastMovement(table.getEntity(row), movement, changeX, changeY, changeZ)
+
+        for entity in dirtyEntities:
+            entityManager.moveEntity(entity)
+
+        for entity in dirtyEntities:
+            self.updateVisibility(entity)
+
+    def updateVisibility(self, entity):
+        if not entity.spawned:
+            return
+
+        entityManager = self._world.entityManager
+        viewRadius = entityManager.viewRadius + self.VIEW_MARGIN
+        x, z = entity.x, entity.z
+
+        visibleEntities = list(entity.visibleEntities)
+        distances = entityManager.table.getDistancesSquared(x, z, [otherEntity.row for otherEntity in \
+            visibleEntities])
+
+        for otherEntity, distance in itertools.izip(visibleEntities, distances):
+            if distance > viewRadius * viewRadius:
+                self.hideEntities(entity, otherEntity)
+
+        for otherEntity in entityManager.getEntitiesInRange(x, z):
+            if otherEntity is entity or not otherEntity.spawned or otherEntity in entity.visibleEntities:
+                continue
+
+            self.showEntities(entity, otherEntity)
+
+    def showEntities(self, entity, otherEntity):
+        entity.visibleEntities.add(otherEntity)
+        otherEntity.visibleEntities.add(entity)
+
+        self.sendTo(entity, packet.SpawnPlayer, otherEntity)
+        self.sendTo(otherEntity, packet.SpawnPlayer, entity)
+
+    def hideEntities(self, entity, otherEntity):
+        entity.visibleEntities.discard(otherEntity)
+        otherEntity.visibleEntities.discard(entity)
+
+        self.sendTo(entity, packet.DespawnPlayer, otherEntity)
+        self.sendTo(otherEntity, packet.DespawnPlayer, entity)
+
+    def sendTo(self, entity, serializer, *args):
+        if not entity.protocol:
+            return
+
+        entity.protocol.dispatcher.handleDispatch(serializer.DIRECTION, serializer.ID, *args)
+
+    def broadcastMovement(self, entity, movement, changeX, changeY, changeZ):
+        # movement is only sent to the players which have the entity spawned.
+        protocols = [otherEntity.protocol for otherEntity in entity.visibleEntities if otherEntity.protocol]
+        pausedProtocols = [protocol for protocol in protocols if protocol.sendQueue.paused]
+
+        # a player whose connection is behind is sent the absolute position
+        # instead, which replaces any movement of the entity still queued.
+        if pausedProtocols:
+            protocols = [protocol for protocol in protocols if not protocol.sendQueue.paused]
+            packetBroadcast = packet.PacketBroadcast(packet.PositionAndOrientationStatic.DIRECTION,
+                packet.PositionAndOrientationStatic.ID, entity.id, entity.x, entity.y, entity.z,
+                entity.yaw, entity.pitch)
+
+            for protocol in pausedProtocols:
+                packetBroadcast.send(protocol, (packet.PositionAndOrientationStatic.ID, entity.id))
+
+        if movement == EntityMovement.TELEPORT:
+            self.broadcast(protocols, packet.PositionAndOrientationStatic, entity.id, entity.x,
+                entity.y, entity.z, entity.yaw, entity.pitch)
+
+        elif movement == EntityMovement.MOVE_AND_ROTATE:
+            self.broadcast(protocols, packet.PositionAndOrientationUpdate, entity.id, changeX,
+                changeY, changeZ, entity.yaw, entity.pitch)
+
+        elif movement == EntityMovement.MOVE:
+            self.broadcast(protocols, packet.PositionUpdate, entity.id, changeX, changeY, changeZ)
+        else:
+            self.broadcast(protocols, packet.OrientationUpdate, entity.id, entity.yaw, entity.pitch)
+
+    def broadcast(self, protocols, serializer, *args):
+        if not protocols:
+            return
+
+        self._world.worldManager.factory.broadcastTo(protocols, serializer.DIRECTION, serializer.ID, [], *args)
@@ -6,6 +6,11 @@
 
 import sys
 import time
+import json
+import atexit
+import threading
+import traceback
+import Queue
 
 from colorama import init
 from colorama import Fore, Back, Style
@@ -13,29 +18,232 @@ from colorama import Fore, Back, Style
 init(autoreset=True)
 
 
+class LogLevels(object):
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+
+    @classmethod
+    def getLevel(cls, name):
+        return getattr(cls, name.upper())
+
+class LogRecord(object):
+
+    def __init__(self, timestamp, color, level, message, args, suppressed):
+        self.timestamp = timestamp
+        self.color = color
+        self.level = level
+        self.message = message
+        self.args = args
+        self.suppressed = suppressed
+
+    def getMessage(self):
+        # the message is only formatted by the writer thread, so disabled
+        # or rate limited log calls never pay for string formatting.
+        message = self.message % self.args if self.args else self.message
+
+        if self.suppressed:
+            message = '%s (suppressed %d similar messages)' % (message, self.suppressed)
+
+        return message
+
 class Logger(object):
+    QUEUE_SIZE = 10000
+
+    _level = LogLevels.INFO
+    _rateLimit = 20
+    _rateInterval = 1.0
+    _rateLimits = {}
+    _lastPrune = 0.0
+    _lock = threading.Lock()
+
+    _queue = Queue.Queue(QUEUE_SIZE)
+    _thread = None
+    _jsonFile = None
+    _dropped = 0
+
+    @classmethod
+    def setup(cls, level=LogLevels.INFO, jsonFilename=None, rateLimit=20, rateInterval=1.0):
+        cls._level = level
+        cls._rateLimit = rateLimit
+        cls._rateInterval = rateInterval
+
+        if jsonFilename:
+            cls._jsonFile = open(jsonFilename, 'a')
+
+    @classmethod
+    def isEnabledFor(cls, level):
+        return getattr(LogLevels, level) >= cls._level
 
     @staticmethod
-    def getTimestamp():
-        return time.ctime()
+    def getTimestamp(timestamp=None):
+        return time.ctime(timestamp)
 
     @classmethod
-    def log(cls, color, level, message):
-        print >> sys.stdout, '%s[%s][%s]:: %s\r' % (color,
-            cls.getTimestamp(), level, message)
+    def getRateLimitKey(cls, level, message, args):
+        # info lines such as chat and players joining share a few templates,
+        # so they're only limited when the whole line repeats.
+        if level != 'INFO':
+            return (level, message)
+
+        key = (level, message, args)
+
+        try:
+            hash(key)
+        except TypeError:
+            return (level, message)
+
+        return key
+
+    @classmethod
+    def pruneRateLimits(cls, timestamp):
+        # drops the rate limits whose interval has passed, called with the
+        # lock held. returns the dropped limits which suppressed lines that
+        # haven't been reported yet.
+        if timestamp - cls._lastPrune < cls._rateInterval:
+            return []
+
+        cls._lastPrune = timestamp
+
+        expired = [(key, rateLimit) for key, rateLimit in cls._rateLimits.iteritems() \
+            if timestamp - rateLimit[0] >= cls._rateInterval]
+
+        for key, _ in expired:
+            del cls._rateLimits[key]
+
+        return [(key, rateLimit) for key, rateLimit in expired if rateLimit[2]]
+
+    @classmethod
+    def getSuppressed(cls, color, level, message, args, timestamp):
+        # limit how often the same message can be logged within an interval,
+        # returns the number of suppressed lines to report or None if this
+        # line should be suppressed as well, along with the records for the
+        # lines suppressed by limits that have since expired.
+        key = cls.getRateLimitKey(level, message, args)
+
+        with cls._lock:
+            expired = [LogRecord(timestamp, rateLimit[3], expiredKey[0], rateLimit[4], rateLimit[5], rateLimit[2]) \
+                for expiredKey, rateLimit in cls.pruneRateLimits(timestamp)]
+
+            rateLimit = cls._rateLimits.get(key)
+
+            if not rateLimit or timestamp - rateLimit[0] >= cls._rateInterval:
+                suppressed = rateLimit[2] if rateLimit else 0
+                cls._rateLimits[key] = [timestamp, 1, 0, color, message, args]
+                return suppressed, expired
+
+            if rateLimit[1] >= cls._rateLimit:
+                rateLimit[2] += 1
+                rateLimit[5] = args
+                return None, expired
+
+            rateLimit[1] += 1
+            return 0, expired
+
+    @classmethod
+    def log(cls, color, level, message, *args):
+        if not cls.isEnabledFor(level):
+            return
+
+        timestamp = time.time()
+        suppressed, records = cls.getSuppressed(color, level, message, args, timestamp)
+
+        if suppressed is not None:
+            records.append(LogRecord(timestamp, color, level, message, args, suppressed))
+
+        if not records:
+            return
+
+        if not cls._thread:
+            cls.start()
+
+        for record in records:
+            try:
+                cls._queue.put_nowait(record)
+            except Queue.Full:
+                cls._dropped += 1
+
+    @classmethod
+    def write(cls, record):
+        message = record.getMessage()
+
+        print >> sys.stdout, '%s[%s][%s]:: %s\r' % (record.color,
+            cls.getTimestamp(record.timestamp), record.level, message)
+
+        if cls._jsonFile:
+            cls._jsonFile.write('%s\n' % json.dumps({
+                'timestamp': record.timestamp,
+                'level': record.level,
+                'message': message,
+            }))
+
+    @classmethod
+    def flush(cls):
+        sys.stdout.flush()
+
+        if cls._jsonFile:
+            cls._jsonFile.flush()
+
+    @classmethod
+    def run(cls):
+        while True:
+            record = cls._queue.get()
+
+            if record is None:
+                break
+
+            # a record which can't be written is reported on stderr, the
+            # writer thread has to keep running for every later record.
+            try:
+                cls.write(record)
+
+                if cls._dropped:
+                    dropped, cls._dropped = cls._dropped, 0
+                    cls.write(LogRecord(time.time(), Fore.YELLOW, 'WARNING',
+                        'Dropped %d log messages, the log queue was full!', (dropped,), 0))
+
+                if cls._queue.empty():
+                    cls.flush()
+            except Exception:
+                traceback.print_exc()
+
+        cls.flush()
+
+    @classmethod
+    def start(cls):
+        with cls._lock:
+            if cls._thread:
+                return
+
+            cls._thread = threading.Thread(target=cls.run)
+            cls._thread.daemon = True
+            cls._thread.start()
+
+        atexit.register(cls.stop)
+
+    @classmethod
+    def stop(cls):
+        if not cls._thread:
+            return
+
+        # wait for the writer thread to drain the queue before exiting.
+        cls._queue.put(None)
+        cls._thread.join()
+        cls._thread = None
 
     @classmethod
-    def info(cls, message):
-        cls.log(Fore.GREEN, 'INFO', message)
+    def info(cls, message, *args):
+        cls.log(Fore.GREEN, 'INFO', message, *args)
 
     @classmethod
-    def debug(cls, message):
-        cls.log(Fore.BLUE, 'DEBUG', message)
+    def debug(cls, message, *args):
+        cls.log(Fore.BLUE, 'DEBUG', message, *args)
 
     @classmethod
-    def warning(cls, message):
-        cls.log(Fore.YELLOW, 'WARNING', message)
+    def warning(cls, message, *args):
+        cls.log(Fore.YELLOW, 'WARNING', message, *args)
 
     @classmethod
-    def error(cls, message):
-        cls.log(Fore.RED, 'ERROR', message)
+    def error(cls, message, *args):
+        cls.log(Fore.RED, 'ERROR', message, *args)
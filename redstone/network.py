@@ -4,10 +4,17 @@
  * Licensing information can found in 'LICENSE', which is part of this source code package.
 """
 
+import io
+import random
 import urllib
-import urllib2
+import collections
 
+from zope.interface import implementer
+from twisted.internet import reactor, defer
+from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Protocol, ServerFactory
+from twisted.web.client import Agent, FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
 
 import redstone
 import redstone.logging as logging
@@ -18,18 +25,44 @@ import redstone.command as command
 import redstone.task as task
 
 
+class NetworkStatusError(RuntimeError):
+    pass
+
 class NetworkStatus(object):
 
-    def __init__(self, factory, delay=5.0):
+    def __init__(self, factory, url, delay=5.0, timeout=10.0, maxDelay=300.0):
         self._factory = factory
+        self._url = url
         self._delay = delay
+        self._timeout = timeout
+        self._maxDelay = maxDelay
+        self._agent = Agent(reactor, connectTimeout=timeout)
+        self._pending = False
+        self._failures = 0
+        self._serverUrl = None
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def failures(self):
+        return self._failures
+
+    @property
+    def serverUrl(self):
+        return self._serverUrl
 
     def setup(self):
         self._update_task = self._factory.add_task('status-update', self.__update,
             priority=-1, delay=self._delay)
 
     def __update(self, task):
-        url = 'http://www.classicube.net/server/heartbeat'
+        # never have more than one heartbeat in flight, a slow server list
+        # shouldn't pile up connections.
+        if self._pending:
+            return task.wait
+
         fields = {
             'port': self._factory.daemon.port,
             'max': 1024,
@@ -37,30 +70,203 @@ class NetworkStatus(object):
             'public': self._factory.daemon.public,
             'version': 7,
             'salt': self._factory.salt,
-            'users': self._factory.worldManager.getNumPlayers(),
+            'users': self._factory.worldManager.numPlayers,
             'software': self._factory.daemon.software,
         }
 
-        request = urllib2.Request(url, urllib.urlencode(fields))
+        self._pending = True
 
-        try:
-            response = urllib2.urlopen(request).read()
-        except:
-            logging.Logger.warning('Failed to ping server list!')
+        deferred = self._agent.request('POST', self._url, Headers({
+            'Content-Type': ['application/x-www-form-urlencoded'],
+        }), FileBodyProducer(io.BytesIO(urllib.urlencode(fields))))
+
+        deferred.addCallback(self.__handleResponse)
+        deferred.addTimeout(self._timeout, reactor)
+        deferred.addCallbacks(self.__handleSuccess, self.__handleFailure)
 
         return task.wait
 
+    def __handleResponse(self, response):
+        if response.code != 200:
+            raise NetworkStatusError('Unexpected response code %d!' % response.code)
+
+        return readBody(response)
+
+    def __handleSuccess(self, serverUrl):
+        self._pending = False
+        self._failures = 0
+
+        if serverUrl != self._serverUrl:
+            logging.Logger.info('Server list url: %s', serverUrl)
+
+        self._serverUrl = serverUrl
+
+    def __handleFailure(self, failure):
+        self._pending = False
+        self._failures += 1
+
+        # back off exponentially while the server list is unreachable, with
+        # jitter so that restarted servers don't all retry at the same time.
+        backoffDelay = min(self._maxDelay, self._delay * 2 ** self._failures)
+        delay = random.uniform(self._delay, backoffDelay)
+
+        if self._factory.has_task('status-update'):
+            self._factory.reschedule_task(self._update_task, delay)
+
+        logging.Logger.warning('Failed to ping server list (%s), retrying in %.1f seconds!',
+            failure.type.__name__, delay)
+
+@implementer(IPushProducer)
+class SendQueue(object):
+    """
+    Buffers the packets sent to a protocol and writes them to the transport
+    all at once, the transport pauses the queue while the client falls behind
+    """
+
+    def __init__(self, protocol, maxBufferSize):
+        self._protocol = protocol
+        self._maxBufferSize = maxBufferSize
+        self._entries = collections.deque()
+        self._keys = {}
+        self._size = 0
+        self._paused = False
+        self._stopped = False
+        self._flushCall = None
+        self._resumeWaiters = []
+        self._numSuperseded = 0
+
+    @property
+    def maxBufferSize(self):
+        return self._maxBufferSize
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def paused(self):
+        return self._paused
+
+    @property
+    def numSuperseded(self):
+        return self._numSuperseded
+
+    def write(self, data, key=None):
+        """
+        Queues data to be written on the next reactor iteration, data that
+        has a key replaces anything queued with the same key that hasn't been
+        written yet
+        """
+
+        if self._stopped:
+            return
+
+        if key is not None:
+            entry = self._keys.get(key)
+
+            # the newer data is queued at the end, so it's never sent before
+            # anything that was queued in between.
+            if entry is not None:
+                self._size -= len(entry[0])
+                self._numSuperseded += 1
+                entry[0] = None
+
+        entry = [data]
+        self._entries.append(entry)
+        self._size += len(data)
+
+        if key is not None:
+            self._keys[key] = entry
+
+        # only data that can't be written counts, a client that isn't keeping
+        # up is dropped rather than have everything sent to it held in memory.
+        if self._paused:
+            if self._size > self._maxBufferSize:
+                self.handleOverflow()
+
+            return
+
+        if not self._flushCall:
+            self._flushCall = reactor.callLater(0, self.flush)
+
+    def cancelFlush(self):
+        if self._flushCall and self._flushCall.active():
+            self._flushCall.cancel()
+
+        self._flushCall = None
+
+    def flush(self, force=False):
+        self.cancelFlush()
+
+        if self._stopped or (self._paused and not force) or not self._entries:
+            return
+
+        entries, self._entries = self._entries, collections.deque()
+        self._keys.clear()
+        self._size = 0
+
+        self._protocol.transport.writeSequence([entry[0] for entry in entries if entry[0] is not None])
+
+    def whenResumed(self):
+        # returns a deferred which fires once the queue is no longer paused.
+        if not self._paused:
+            return defer.succeed(None)
+
+        deferred = defer.Deferred()
+        self._resumeWaiters.append(deferred)
+
+        return deferred
+
+    def handleOverflow(self):
+        logging.Logger.warning('Disconnecting slow client %s, %d bytes are queued!',
+            self._protocol.transport.getPeer().host, self._size)
+
+        self.stopProducing()
+        self._protocol.transport.abortConnection()
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        self.flush()
+
+        resumeWaiters, self._resumeWaiters = self._resumeWaiters, []
+
+        for deferred in resumeWaiters:
+            deferred.callback(None)
+
+    def stopProducing(self):
+        if self._stopped:
+            return
+
+        self._stopped = True
+        self.cancelFlush()
+
+        self._entries.clear()
+        self._keys.clear()
+        self._size = 0
+
+        # anything waiting for the queue to resume checks the connection.
+        self.resumeProducing()
+
 class NetworkProtocol(Protocol):
 
     def __init__(self):
         self._dispatcher = packet.PacketDispatcher(self)
         self._commandParser = command.CommandParser(self)
+        self._sendQueue = None
         self._entity = None
+        self._receiveBuffer = bytearray()
 
     @property
     def dispatcher(self):
         return self._dispatcher
 
+    @property
+    def sendQueue(self):
+        return self._sendQueue
+
     @property
     def commandParser(self):
         return self._commandParser
@@ -74,25 +280,54 @@ class NetworkProtocol(Protocol):
         self._entity = entity
 
     def connectionMade(self):
+        # the transport pauses the send queue once it's buffer is full.
+        self._sendQueue = SendQueue(self, self.factory.daemon.sendBufferLimit)
+        self.transport.registerProducer(self._sendQueue, True)
+
         self.factory.addProtocol(self)
 
     def dataReceived(self, data):
-        dataBuffer = util.DataBuffer(data)
+        self._receiveBuffer.extend(data)
 
-        while dataBuffer.remaining:
-            self.handleIncoming(dataBuffer)
+        # packets may be split across or packed into tcp segments, so only
+        # decode the complete packets and leave any partial packet buffered
+        # until the rest of it arrives.
+        receiveBuffer = memoryview(self._receiveBuffer)
+        receiveLength = len(self._receiveBuffer)
+        offset = 0
 
-    def handleIncoming(self, dataBuffer):
         try:
-            packetId = dataBuffer.readByte()
-        except:
-            self.handleDisconnect()
-            return
+            while offset < receiveLength and not self.transport.disconnecting:
+                packetId = self._receiveBuffer[offset]
+                packetLength = packet.DOWNSTREAM_PACKET_LENGTHS[packetId]
+
+                if not packetLength:
+                    # there is no way to find the start of the next packet
+                    # after an unknown packet id, drop the connection.
+                    self._dispatcher.handleDiscard(packet.PacketDirections.DOWNSTREAM, packetId)
+                    self.handleDisconnect()
+                    break
+
+                if offset + packetLength > receiveLength:
+                    break
+
+                self.handleIncoming(packetId, receiveBuffer[offset:offset + packetLength])
 
+                offset += packetLength
+        finally:
+            del receiveBuffer
+
+            # compact the receive buffer once per read, keeping only
+            # the partial packet that hasn't been decoded yet.
+            self._receiveBuffer = self._receiveBuffer[offset:]
+
+    def handleIncoming(self, packetId, data):
         self._dispatcher.handleDispatch(packet.PacketDirections.DOWNSTREAM,
-            packetId, dataBuffer)
+            packetId, data)
 
     def handleDisconnect(self):
+        # the transport only writes what it was given before it disconnects.
+        self._sendQueue.flush(force=True)
         self.transport.loseConnection()
 
     def connectionLost(self, reason=None):
@@ -108,7 +343,7 @@ class NetworkFactory(ServerFactory, task.TaskManager):
         self._protocols = []
         self._salt = util.generateRandomSalt()
         self._worldManager = world.WorldManager(self)
-        self._status = NetworkStatus(self)
+        self._status = NetworkStatus(self, daemon.heartbeatUrl)
 
     @property
     def daemon(self):
@@ -130,10 +365,34 @@ class NetworkFactory(ServerFactory, task.TaskManager):
         logging.Logger.info('Starting up, please wait...')
         self._status.setup()
         self._worldManager.setup()
+
+        self._tickTask = self.add_task('world-tick', self.__tick,
+            delay=1.0 / self._daemon.tickRate)
+
+        self._journalTask = self.add_task('journal-sync', self.__syncJournals,
+            delay=self._daemon.journalInterval)
+
+        self._unloadTask = self.add_task('world-unload', self.__unloadWorlds,
+            delay=1.0)
+
         logging.Logger.info('Done.')
 
+    def __tick(self, task):
+        self._worldManager.update()
+        return task.wait
+
+    def __syncJournals(self, task):
+        self._worldManager.syncJournals()
+        return task.wait
+
+    def __unloadWorlds(self, task):
+        self._worldManager.unloadIdleWorlds()
+        return task.wait
+
     def stopFactory(self):
         logging.Logger.info('Shutting down, please wait...')
+        self._worldManager.closeJournals()
+        self._worldManager.compressor.close()
 
     def addProtocol(self, protocol):
         if protocol in self._protocols:
@@ -148,7 +407,7 @@ class NetworkFactory(ServerFactory, task.TaskManager):
         if not protocol.entity:
             return
 
-        world = self.worldManager.getWorldFromEntity(protocol.entity.id)
+        world = self.worldManager.getWorld(protocol.entity.world)
         world.removePlayer(protocol)
 
         self._protocols.remove(protocol)
@@ -157,10 +416,17 @@ class NetworkFactory(ServerFactory, task.TaskManager):
         return protocol in self._protocols
 
     def broadcast(self, direction, packetId, exceptions, *args, **kwargs):
-        for protocol in self._protocols:
+        self.broadcastTo(self._protocols, direction, packetId, exceptions, *args, **kwargs)
+
+    def broadcastTo(self, protocols, direction, packetId, exceptions, *args, **kwargs):
+        exceptions = frozenset(exceptions)
+
+        # serialize the packet once and write the same buffer to every protocol.
+        packetBroadcast = packet.PacketBroadcast(direction, packetId, *args, **kwargs)
+
+        for protocol in protocols:
 
             if protocol in exceptions:
                 continue
 
-            protocol.dispatcher.handleDispatch(direction, packetId,
-                *args, **kwargs)
+            packetBroadcast.send(protocol)
@@ -4,10 +4,14 @@
  * Licensing information can found in 'LICENSE', which is part of this source code package.
 """
 
+import time
 import hashlib
 import hmac
+import struct
 import enum
 
+from twisted.internet.task import cooperate, TaskDone, TaskStopped
+
 import redstone.util as util
 import redstone.logging as logging
 
@@ -19,6 +23,8 @@ class PacketDirections(enum.Enum):
 class PacketSerializer(object):
     ID = None
     DIRECTION = None
+    STRUCT = None
+    SELF_ID_OFFSET = None
 
     def __init__(self, dispatcher, protocol):
         self._protocol = protocol
@@ -40,6 +46,25 @@ class PacketSerializer(object):
     def serializableCallback(self):
         return self.serializeComplete if self.DIRECTION == PacketDirections.UPSTREAM else self.deserializeComplete
 
+    @classmethod
+    def encode(cls, *args, **kwargs):
+        # packets which don't depend on the protocol they are sent to
+        # override this, so a broadcast only has to encode them once.
+        return None
+
+    @classmethod
+    def getEntityId(cls, *args, **kwargs):
+        # packets which reference an entity that the receiving player sees
+        # as themselves (id -1) return that entity's id here.
+        return None
+
+    @classmethod
+    def patchEntityId(cls, data):
+        data = bytearray(data)
+        data[cls.SELF_ID_OFFSET] = 0xff
+
+        return bytes(data)
+
     def serialize(self, *args, **kwargs):
         return None
 
@@ -55,67 +80,58 @@ class PacketSerializer(object):
 class SetBlockServer(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x06
+    STRUCT = struct.Struct('!BhhhB')
 
-    def serialize(self, x, y, z, blockType):
-        dataBuffer = util.DataBuffer()
-        dataBuffer.writeShort(x)
-        dataBuffer.writeShort(y)
-        dataBuffer.writeShort(z)
-        dataBuffer.writeByte(blockType)
+    @classmethod
+    def encode(cls, x, y, z, blockType):
+        return cls.STRUCT.pack(cls.ID, x, y, z, blockType)
 
-        return dataBuffer
+    def serialize(self, x, y, z, blockType):
+        return self.encode(x, y, z, blockType)
 
 class SetBlockClient(PacketSerializer):
     DIRECTION = PacketDirections.DOWNSTREAM
     ID = 0x05
+    STRUCT = struct.Struct('!BhhhBB')
 
-    def deserialize(self, dataBuffer):
-        try:
-            x = dataBuffer.readShort()
-            y = dataBuffer.readShort()
-            z = dataBuffer.readShort()
-            mode = dataBuffer.readByte()
-            blockType = dataBuffer.readByte()
-        except:
-            self._protocol.handleDisconnect()
-            return
+    def deserialize(self, data):
+        _, x, y, z, mode, blockType = self.STRUCT.unpack_from(data)
 
-        world = self._protocol.factory.worldManager.getWorldFromEntity(
-            self._protocol.entity.id)
+        world = self._protocol.factory.worldManager.getWorld(
+            self._protocol.entity.world)
 
         # todo: use block types instead of hard coded block types.
         if mode == util.Mouse.LEFT_CLICK:
             blockType = util.BlockIds.AIR
 
+        # queue the block update for all other clients, the changes are sent
+        # together on the next world tick. this happens before the block is set
+        # so any physics changes to the same block replace this one.
+        world.blockChangeQueue.queueChange(x, y, z, blockType, self._protocol)
+
         # set the block on the world instance
         world.setBlock(x, y, z, blockType)
 
-        # now broadcast update for the block to all clients
-        self._protocol.factory.worldManager.broadcast(world, SetBlockServer.DIRECTION,
-            SetBlockServer.ID, [self._protocol], x, y, z, blockType)
-
 class ServerMessage(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x0d
+    STRUCT = struct.Struct('!Bb64s')
 
-    def serialize(self, entityId, message):
-        dataBuffer = util.DataBuffer()
-        dataBuffer.writeSByte(entityId)
-        dataBuffer.writeString(message)
+    @classmethod
+    def encode(cls, entityId, message):
+        return cls.STRUCT.pack(cls.ID, entityId, util.padString(message))
 
-        return dataBuffer
+    def serialize(self, entityId, message):
+        return self.encode(entityId, message)
 
 class ClientMessage(PacketSerializer):
     DIRECTION = PacketDirections.DOWNSTREAM
     ID = 0x0d
+    STRUCT = struct.Struct('!BB64s')
 
-    def deserialize(self, dataBuffer):
-        try:
-            playerId = dataBuffer.readByte()
-            message = dataBuffer.readString()
-        except:
-            self._protocol.handleDisconnect()
-            return
+    def deserialize(self, data):
+        _, playerId, message = self.STRUCT.unpack_from(data)
+        message = message.strip()
 
         entity = self._protocol.entity
 
@@ -141,7 +157,7 @@ class ClientMessage(PacketSerializer):
 
             return
 
-        logging.Logger.info('%s: %s' % (entity.username, message))
+        logging.Logger.info('%s: %s', entity.username, message)
 
         message = '%s: %s' % ('%s%s%s' % (self.getColorFromRank(entity), entity.username, util.ChatColors.WHITE),
             self.sanitize(message))
@@ -167,108 +183,96 @@ class ClientMessage(PacketSerializer):
 class PositionAndOrientationStatic(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x08
+    STRUCT = struct.Struct('!BbhhhBB')
+    SELF_ID_OFFSET = 1
+
+    @classmethod
+    def encode(cls, entityId, x, y, z, yaw, pitch):
+        return cls.STRUCT.pack(cls.ID, entityId, int(x * 32.0), int(y * 32.0), int(z * 32.0),
+            yaw, pitch)
+
+    @classmethod
+    def getEntityId(cls, entityId, *args):
+        return entityId
 
     def serialize(self, entityId, x, y, z, yaw, pitch):
         if not self._protocol.entity:
             return
 
-        dataBuffer = util.DataBuffer()
-        dataBuffer.writeSByte(-1 if entityId == self._protocol.entity.id else entityId)
-        dataBuffer.writeShort(x * 32.0)
-        dataBuffer.writeShort(y * 32.0)
-        dataBuffer.writeShort(z * 32.0)
-        dataBuffer.writeByte(yaw)
-        dataBuffer.writeByte(pitch)
-
-        return dataBuffer
+        return self.encode(-1 if entityId == self._protocol.entity.id else entityId,
+            x, y, z, yaw, pitch)
 
 class PositionAndOrientationUpdate(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x09
+    STRUCT = struct.Struct('!BbbbbBB')
+
+    @classmethod
+    def encode(cls, entityId, x, y, z, yaw, pitch):
+        return cls.STRUCT.pack(cls.ID, entityId, int(x), int(y), int(z), yaw, pitch)
 
     def serialize(self, entityId, x, y, z, yaw, pitch):
-        dataBuffer = util.DataBuffer()
-        dataBuffer.writeSByte(entityId)
-        dataBuffer.writeSByte(x)
-        dataBuffer.writeSByte(y)
-        dataBuffer.writeSByte(z)
-        dataBuffer.writeByte(yaw)
-        dataBuffer.writeByte(pitch)
+        return self.encode(entityId, x, y, z, yaw, pitch)
+
+class PositionUpdate(PacketSerializer):
+    DIRECTION = PacketDirections.UPSTREAM
+    ID = 0x0a
+    STRUCT = struct.Struct('!Bbbbb')
 
-        return dataBuffer
+    @classmethod
+    def encode(cls, entityId, x, y, z):
+        return cls.STRUCT.pack(cls.ID, entityId, x, y, z)
+
+    def serialize(self, entityId, x, y, z):
+        return self.encode(entityId, x, y, z)
+
+class OrientationUpdate(PacketSerializer):
+    DIRECTION = PacketDirections.UPSTREAM
+    ID = 0x0b
+    STRUCT = struct.Struct('!BbBB')
+
+    @classmethod
+    def encode(cls, entityId, yaw, pitch):
+        return cls.STRUCT.pack(cls.ID, entityId, yaw, pitch)
+
+    def serialize(self, entityId, yaw, pitch):
+        return self.encode(entityId, yaw, pitch)
 
 class PositionAndOrientation(PacketSerializer):
     DIRECTION = PacketDirections.DOWNSTREAM
     ID = 0x08
+    STRUCT = struct.Struct('!BBhhhBB')
 
-    def deserialize(self, dataBuffer):
-        try:
-            playerId = dataBuffer.readByte()
-            x = dataBuffer.readShort()
-            y = dataBuffer.readShort()
-            z = dataBuffer.readShort()
-            yaw = dataBuffer.readByte()
-            pitch = dataBuffer.readByte()
-        except:
-            self._protocol.handleDisconnect()
-            return
-
-        x = x / 32.0
-        y = y / 32.0
-        z = z / 32.0
+    def deserialize(self, data):
+        _, playerId, x, y, z, yaw, pitch = self.STRUCT.unpack_from(data)
 
         entity = self._protocol.entity
 
         if not entity:
             return
 
-        world = self._protocol.factory.worldManager.getWorldFromEntity(entity.id)
+        world = self._protocol.factory.worldManager.getWorld(entity.world)
 
         if not world:
             return
 
-        changeX = entity.x - x
-        changeY = entity.y - y
-        changeZ = entity.z - z
-
-        changeX = -changeX * 32.0
-        changeY = -changeY * 32.0
-        changeZ = -changeZ * 32.0
-
-        entity.x = x
-        entity.y = y
-        entity.z = z
-
-        changeYaw = entity.yaw - yaw
-        changePitch = entity.pitch - pitch
-
+        entity.x = x / 32.0
+        entity.y = y / 32.0
+        entity.z = z / 32.0
         entity.yaw = yaw
         entity.pitch = pitch
 
-        if self.isOutOfRange(changeX) or self.isOutOfRange(changeY) or self.isOutOfRange(changeZ):
-            self._protocol.factory.worldManager.broadcast(world, PositionAndOrientationStatic.DIRECTION, PositionAndOrientationStatic.ID, [self._protocol],
-                entity.id, entity.x, entity.y, entity.z, entity.yaw, entity.pitch)
-
-            return
-
-        self._protocol.factory.worldManager.broadcast(world, PositionAndOrientationUpdate.DIRECTION, PositionAndOrientationUpdate.ID, [self._protocol],
-            self._protocol.entity.id if playerId == 255 else playerId, changeX, changeY, changeZ, entity.yaw, entity.pitch)
-
-    def isOutOfRange(self, value):
-        if value < -128 or value > 127:
-            return True
-
-        return False
+        # the movement is broadcasted on the next world tick, coalescing
+        # every position packet the client sent since the last one.
+        world.movementManager.markDirty(entity)
 
 class DisconnectPlayer(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x0e
+    STRUCT = struct.Struct('!B64s')
 
     def serialize(self, reason):
-        dataBuffer = util.DataBuffer()
-        dataBuffer.writeString(reason)
-
-        return dataBuffer
+        return self.STRUCT.pack(self.ID, util.padString(reason))
 
     def serializeComplete(self):
         self._protocol.handleDisconnect()
@@ -276,129 +280,198 @@ class DisconnectPlayer(PacketSerializer):
 class DespawnPlayer(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x0c
+    STRUCT = struct.Struct('!Bb')
 
-    def serialize(self, entity):
-        dataBuffer = util.DataBuffer()
-        dataBuffer.writeSByte(entity.id)
+    @classmethod
+    def encode(cls, entity):
+        return cls.STRUCT.pack(cls.ID, entity.id)
 
-        return dataBuffer
+    def serialize(self, entity):
+        return self.encode(entity)
 
 class SpawnPlayer(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x07
+    STRUCT = struct.Struct('!Bb64shhhBB')
+    SELF_ID_OFFSET = 1
+
+    @classmethod
+    def encode(cls, entity):
+        return cls.STRUCT.pack(cls.ID, entity.id, util.padString(entity.username),
+            int(entity.x * 32.0), int(entity.y * 32.0), int(entity.z * 32.0), entity.yaw,
+            entity.pitch)
+
+    @classmethod
+    def getEntityId(cls, entity):
+        return entity.id
 
     def serialize(self, entity):
         if not self._protocol.entity:
             return
 
-        dataBuffer = util.DataBuffer()
-        dataBuffer.writeSByte(-1 if entity.id == self._protocol.entity.id else entity.id)
-        dataBuffer.writeString(entity.username)
-        dataBuffer.writeShort(entity.x * 32.0)
-        dataBuffer.writeShort(entity.y * 32.0)
-        dataBuffer.writeShort(entity.z * 32.0)
-        dataBuffer.writeByte(entity.yaw)
-        dataBuffer.writeByte(entity.pitch)
+        data = self.encode(entity)
+
+        if entity.id == self._protocol.entity.id:
+            data = self.patchEntityId(data)
 
-        return dataBuffer
+        return data
 
 class LevelFinalize(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x04
+    STRUCT = struct.Struct('!Bhhh')
 
     def serialize(self):
-        world = self._protocol.factory.worldManager.getWorldFromEntity(
-            self._protocol.entity.id)
+        world = self._protocol.factory.worldManager.getWorld(
+            self._protocol.entity.world)
 
-        dataBuffer = util.DataBuffer()
-        dataBuffer.writeShort(world.width)
-        dataBuffer.writeShort(world.height)
-        dataBuffer.writeShort(world.depth)
-
-        return dataBuffer
+        return self.STRUCT.pack(self.ID, world.width, world.height, world.depth)
 
     def serializeComplete(self):
-        world = self._protocol.factory.worldManager.getWorldFromEntity(
-            self._protocol.entity.id)
+        world = self._protocol.factory.worldManager.getWorld(
+            self._protocol.entity.world)
 
         world.updatePlayers(self._protocol)
 
 class LevelDataChunk(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x03
+    STRUCT = struct.Struct('!Bh1024sB')
 
-    def serialize(self, chunkCount, chunk):
-        dataBuffer = util.DataBuffer()
-        dataBuffer.writeShort(len(chunk))
-        dataBuffer.writeArray(chunk)
-        dataBuffer.writeByte(int((100 / len(chunk)) * chunkCount))
-
-        return dataBuffer
+    def serialize(self, chunk, percent):
+        return self.STRUCT.pack(self.ID, len(chunk), chunk, percent)
 
 class LevelInitialize(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x02
+    STRUCT = struct.Struct('!B')
+
+    def __init__(self, dispatcher, protocol):
+        super(LevelInitialize, self).__init__(dispatcher, protocol)
+
+        self._sendTask = None
 
     def serialize(self):
-        return util.DataBuffer()
+        return self.STRUCT.pack(self.ID)
 
     def serializeComplete(self):
-        chunk = self._protocol.factory.worldManager.getWorldFromEntity(
-            self._protocol.entity.id).serialize()
+        world = self._protocol.factory.worldManager.getWorld(
+            self._protocol.entity.world)
+
+        # a level which is still being sent is for a world the player left.
+        if self._sendTask:
+            try:
+                self._sendTask.stop()
+            except TaskDone:
+                pass
+
+        # the level is sent cooperatively, other players are served in
+        # between each piece of the level that's compressed and sent.
+        self._sendTask = cooperate(self.__sendLevel(world))
+        self._sendTask.whenDone().addErrback(lambda failure: failure.trap(TaskStopped))
+
+    def __sendLevel(self, world):
+        worldManager = self._protocol.factory.worldManager
+        startTime = time.time()
+        firstChunk = True
+
+        levelStream = world.getLevelStream(worldManager.levelCompression)
+
+        for chunk, percent in levelStream:
+            # wait for a client that's behind to catch up rather than queue
+            # the whole level for it.
+            if self._protocol.sendQueue.paused:
+                yield self._protocol.sendQueue.whenResumed()
+
+            if not self._protocol.transport.connected:
+                return
 
-        chunks = [chunk[i: i + 1024] for i in xrange(0, len(chunk), 1024)]
+            if chunk is not None:
+                self._dispatcher.handleDispatch(LevelDataChunk.DIRECTION, LevelDataChunk.ID,
+                    chunk, percent)
 
-        for chunkCount, chunk in enumerate(chunks):
-            self._dispatcher.handleDispatch(LevelDataChunk.DIRECTION, LevelDataChunk.ID,
-                chunkCount, chunk)
+                if firstChunk:
+                    firstChunk = False
+                    worldManager.levelFirstChunkStats.record(time.time() - startTime)
+
+            yield None
 
         self._dispatcher.handleDispatch(LevelFinalize.DIRECTION, LevelFinalize.ID)
 
+        # the player only receives block changes once the level is finalized,
+        # anything that changed while the level was being sent is sent now,
+        # a chunk at a time. changes made in between are broadcast as usual.
+        for changes in levelStream.blockData.iterChanges(world.blockData):
+            if not self._protocol.transport.connected:
+                return
+
+            for x, y, z, blockId in changes:
+                self._dispatcher.handleDispatch(SetBlockServer.DIRECTION, SetBlockServer.ID,
+                    x, y, z, blockId)
+
+            yield None
+
+        worldManager.levelSendStats.record(time.time() - startTime)
+
+        logging.Logger.debug('Sent world [%s] in %.2f ms, first chunk after %.2f ms.', world.name,
+            worldManager.levelSendStats.last * 1000.0, worldManager.levelFirstChunkStats.last * 1000.0)
+
 class Ping(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x01
+    STRUCT = struct.Struct('!B')
+
+    @classmethod
+    def encode(cls):
+        return cls.STRUCT.pack(cls.ID)
 
     def serialize(self):
-        return util.DataBuffer()
+        return self.encode()
 
 class ServerIdentification(PacketSerializer):
     DIRECTION = PacketDirections.UPSTREAM
     ID = 0x00
+    STRUCT = struct.Struct('!BB64s64sB')
 
     def serialize(self, username, entity=None, worldName=None):
-        dataBuffer = util.DataBuffer()
-        dataBuffer.writeByte(0x07)
-        dataBuffer.writeString(self.factory.daemon.name)
-        dataBuffer.writeString(self.factory.daemon.motd)
-        dataBuffer.writeByte(0x00)
+        data = self.STRUCT.pack(self.ID, 0x07, util.padString(self.factory.daemon.name),
+            util.padString(self.factory.daemon.motd), 0x00)
 
         if not worldName:
             world = self._protocol.factory.worldManager.getMainWorld()
         else:
             world = self._protocol.factory.worldManager.getWorld(worldName)
 
+        # a full world turns the player away before they leave the world
+        # they're currently in.
+        if world.isFull():
+            self._dispatcher.handleDispatch(DisconnectPlayer.DIRECTION, DisconnectPlayer.ID,
+                'World %s is full!' % world.name)
+
+            return None
+
+        # the player is leaving the world they're currently in.
         if entity:
-            world.removePlayer(self._protocol)
+            self._protocol.factory.worldManager.getWorld(entity.world).removePlayer(self._protocol)
 
         world.addPlayer(self._protocol, username)
-        return dataBuffer
+        return data
 
     def serializeComplete(self):
+        if self._protocol.transport.disconnecting:
+            return
+
         self._dispatcher.handleDispatch(LevelInitialize.DIRECTION, LevelInitialize.ID)
 
 class PlayerIdentification(PacketSerializer):
     DIRECTION = PacketDirections.DOWNSTREAM
     ID = 0x00
+    STRUCT = struct.Struct('!BB64s64sB')
 
-    def deserialize(self, dataBuffer):
-        try:
-            protocolVersion = dataBuffer.readByte()
-            username = dataBuffer.readString()
-            verificationKey = dataBuffer.readString()
-            protocolType = dataBuffer.readByte()
-        except:
-            self._protocol.handleDisconnect()
-            return
+    def deserialize(self, data):
+        _, protocolVersion, username, verificationKey, protocolType = self.STRUCT.unpack_from(data)
+        username = username.strip()
+        verificationKey = verificationKey.strip()
 
         if self._protocol.factory.worldManager.getEntityFromUsername(username):
             self._dispatcher.handleDispatch(DisconnectPlayer.DIRECTION, DisconnectPlayer.ID,'There is already a player logged in with that username!')
@@ -414,36 +487,48 @@ class PlayerIdentification(PacketSerializer):
         self._dispatcher.handleDispatch(ServerIdentification.DIRECTION, ServerIdentification.ID, username)
 
 class PacketDispatcher(object):
+    SERIALIZERS = {
+        PacketDirections.DOWNSTREAM: {
+            PlayerIdentification.ID: PlayerIdentification,
+            PositionAndOrientation.ID: PositionAndOrientation,
+            ClientMessage.ID: ClientMessage,
+            SetBlockClient.ID: SetBlockClient,
+        },
+        PacketDirections.UPSTREAM: {
+            ServerIdentification.ID: ServerIdentification,
+            Ping.ID: Ping,
+            LevelInitialize.ID: LevelInitialize,
+            LevelDataChunk.ID: LevelDataChunk,
+            LevelFinalize.ID: LevelFinalize,
+            SpawnPlayer.ID: SpawnPlayer,
+            DespawnPlayer.ID: DespawnPlayer,
+            PositionAndOrientationStatic.ID: PositionAndOrientationStatic,
+            PositionAndOrientationUpdate.ID: PositionAndOrientationUpdate,
+            PositionUpdate.ID: PositionUpdate,
+            OrientationUpdate.ID: OrientationUpdate,
+            ServerMessage.ID: ServerMessage,
+            SetBlockServer.ID: SetBlockServer,
+            DisconnectPlayer.ID: DisconnectPlayer,
+        }
+    }
 
     def __init__(self, protocol):
-        self._dispatchers = {
-            PacketDirections.DOWNSTREAM: {
-                PlayerIdentification.ID: PlayerIdentification(self, protocol),
-                PositionAndOrientation.ID: PositionAndOrientation(self, protocol),
-                ClientMessage.ID: ClientMessage(self, protocol),
-                SetBlockClient.ID: SetBlockClient(self, protocol),
-            },
-            PacketDirections.UPSTREAM: {
-                ServerIdentification.ID: ServerIdentification(self, protocol),
-                Ping.ID: Ping(self, protocol),
-                LevelInitialize.ID: LevelInitialize(self, protocol),
-                LevelDataChunk.ID: LevelDataChunk(self, protocol),
-                LevelFinalize.ID: LevelFinalize(self, protocol),
-                SpawnPlayer.ID: SpawnPlayer(self, protocol),
-                DespawnPlayer.ID: DespawnPlayer(self, protocol),
-                PositionAndOrientationStatic.ID: PositionAndOrientationStatic(self, protocol),
-                PositionAndOrientationUpdate.ID: PositionAndOrientationUpdate(self, protocol),
-                ServerMessage.ID: ServerMessage(self, protocol),
-                SetBlockServer.ID: SetBlockServer(self, protocol),
-                DisconnectPlayer.ID: DisconnectPlayer(self, protocol),
-            }
-        }
+        self._protocol = protocol
+        self._dispatchers = {}
 
-    def handleSend(self, dispatcher, otherDataBuffer):
-        dataBuffer = util.DataBuffer()
-        dataBuffer.writeByte(dispatcher.ID)
-        dataBuffer.write(otherDataBuffer.data)
-        dispatcher.protocol.transport.write(dataBuffer.data)
+        for direction, serializers in self.SERIALIZERS.items():
+            self._dispatchers[direction] = {packetId: serializer(self, protocol) for packetId, serializer in \
+                serializers.items()}
+
+    @classmethod
+    def getSerializer(cls, direction, packetId):
+        return cls.SERIALIZERS.get(direction, {}).get(packetId)
+
+    def handleSend(self, dispatcher, data):
+        self.handleWrite(data)
+
+    def handleWrite(self, data, key=None):
+        self._protocol.sendQueue.write(data, key)
 
     def handleDispatch(self, direction, packetId, *args, **kwargs):
         if direction not in self._dispatchers or packetId not in self._dispatchers[direction]:
@@ -454,10 +539,10 @@ class PacketDispatcher(object):
 
     def handleSerializable(self, dispatcher, *args, **kwargs):
         try:
-            otherDataBuffer = dispatcher.serializable(*args, **kwargs)
+            data = dispatcher.serializable(*args, **kwargs)
 
-            if otherDataBuffer:
-                self.handleSend(dispatcher, otherDataBuffer)
+            if data:
+                self.handleSend(dispatcher, data)
         finally:
             self.handleSerializableCallback(dispatcher)
 
@@ -465,4 +550,73 @@ class PacketDispatcher(object):
         dispatcher.serializableCallback()
 
     def handleDiscard(self, direction, packetId):
-        logging.Logger.warning('Discarding incoming packet %d!' % packetId)
+        logging.Logger.warning('Discarding incoming packet %d!', packetId)
+
+class PacketBroadcast(object):
+    """
+    Encodes a packet once so that the same buffer can be written to
+    every protocol it is broadcasted to
+    """
+
+    def __init__(self, direction, packetId, *args, **kwargs):
+        self._direction = direction
+        self._packetId = packetId
+        self._args = args
+        self._kwargs = kwargs
+
+        self._serializer = PacketDispatcher.getSerializer(direction, packetId)
+        self._data = None
+        self._selfData = None
+        self._entityId = None
+
+        if self._serializer:
+            self._data = self._serializer.encode(*args, **kwargs)
+            self._entityId = self._serializer.getEntityId(*args, **kwargs)
+
+    @property
+    def data(self):
+        return self._data
+
+    def getData(self, protocol):
+        if self._entityId is None:
+            return self._data
+
+        # the packet references an entity, which has to be sent as -1 to
+        # the player that owns it, only that single byte has to be patched.
+        if not protocol.entity:
+            return None
+
+        if protocol.entity.id != self._entityId:
+            return self._data
+
+        if self._selfData is None:
+            self._selfData = self._serializer.patchEntityId(self._data)
+
+        return self._selfData
+
+    def send(self, protocol, key=None):
+        if self._data is None:
+            # the packet can't be encoded ahead of time, fallback to
+            # serializing it for this protocol.
+            protocol.dispatcher.handleDispatch(self._direction, self._packetId,
+                *self._args, **self._kwargs)
+
+            return
+
+        data = self.getData(protocol)
+
+        if data:
+            protocol.dispatcher.handleWrite(data, key)
+
+def getPacketLengths(serializers):
+    # build a table indexed by packet id which holds the full length
+    # of each packet including it's id, unknown packet ids are zero.
+    packetLengths = [0] * 256
+
+    for serializer in serializers:
+        packetLengths[serializer.ID] = serializer.STRUCT.size
+
+    return tuple(packetLengths)
+
+DOWNSTREAM_PACKET_LENGTHS = getPacketLengths(PacketDispatcher.SERIALIZERS[
+    PacketDirections.DOWNSTREAM].values())
@@ -0,0 +1,144 @@
+"""
+ * Copyright (C) Caleb Marshall - All Rights Reserved
+ * Written by Caleb Marshall <anythingtechpro@gmail.com>, April 23rd, 2017
+ * Licensing information can found in 'LICENSE', which is part of this source code package.
+"""
+
+import os
+import mmap
+import struct
+
+import redstone.chunk as chunk
+
+
+class RegionFileError(Exception):
+    pass
+
+class RegionFile(object):
+    """
+    A world stored as fixed size uncompressed chunks in a memory mapped
+    file, so a save only has to write the chunks that have changed
+    """
+
+    MAGIC = 'RSRG'
+    VERSION = 1
+    HEADER = struct.Struct('!4sBHHHB')
+
+    CHUNK_SHIFT = chunk.CHUNK_SHIFT
+    CHUNK_SIZE = chunk.CHUNK_SIZE
+    CHUNK_VOLUME = chunk.CHUNK_VOLUME
+
+    # the header is padded to a whole chunk, a chunk is exactly one page
+    # so writing a dirty chunk never touches the pages around it.
+    HEADER_SIZE = CHUNK_VOLUME
+
+    def __init__(self, filename, width, height, depth):
+        self._filename = filename
+        self._width = width
+        self._height = height
+        self._depth = depth
+        self._chunksX = (width + self.CHUNK_SIZE - 1) >> self.CHUNK_SHIFT
+        self._chunksY = (height + self.CHUNK_SIZE - 1) >> self.CHUNK_SHIFT
+        self._chunksZ = (depth + self.CHUNK_SIZE - 1) >> self.CHUNK_SHIFT
+        self._fileobj = None
+        self._mmap = None
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def numChunks(self):
+        return self._chunksX * self._chunksY * self._chunksZ
+
+    @property
+    def fileSize(self):
+        return self.HEADER_SIZE + self.numChunks * self.CHUNK_VOLUME
+
+    def getDirtyChunks(self, blockData, dirtyChunks):
+        # copy every chunk marked dirty and clear the bitmap, the copies are
+        # written by a worker thread while the world keeps changing. chunks
+        # are laid out the same in the region file as in the chunk store.
+        chunks = []
+        index = dirtyChunks.find('\x01')
+
+        while index != -1:
+            chunks.append((index, bytes(blockData.getChunk(index))))
+            index = dirtyChunks.find('\x01', index + 1)
+
+        dirtyChunks[:] = bytearray(len(dirtyChunks))
+        return chunks
+
+    def create(self, blockData):
+        # the file is written under a temporary name and renamed into place,
+        # so a region file which exists is always complete.
+        tempFilename = '%s.tmp' % self._filename
+
+        # the file is created full of air, so air chunks don't need writing.
+        airChunk = chunk.getUniformChunk(0)
+
+        with open(tempFilename, 'wb') as fileobj:
+            fileobj.write(self.HEADER.pack(self.MAGIC, self.VERSION, self._width, self._height,
+                self._depth, self.CHUNK_SHIFT))
+
+            fileobj.truncate(self.fileSize)
+
+            for index in xrange(self.numChunks):
+                worldChunk = blockData.getChunk(index)
+
+                if worldChunk is not airChunk:
+                    fileobj.seek(self.HEADER_SIZE + index * self.CHUNK_VOLUME)
+                    fileobj.write(bytes(worldChunk))
+
+            fileobj.flush()
+            os.fsync(fileobj.fileno())
+
+        os.rename(tempFilename, self._filename)
+        self.open()
+
+    def open(self):
+        self._fileobj = open(self._filename, 'r+b')
+
+        magic, version, width, height, depth, chunkShift = self.HEADER.unpack(
+            self._fileobj.read(self.HEADER.size))
+
+        if magic != self.MAGIC or version != self.VERSION or chunkShift != self.CHUNK_SHIFT:
+            self.close()
+            raise RegionFileError('Invalid region file %s!' % self._filename)
+
+        if (width, height, depth) != (self._width, self._height, self._depth):
+            self.close()
+            raise RegionFileError('Region file %s has the wrong dimensions!' % self._filename)
+
+        if os.fstat(self._fileobj.fileno()).st_size != self.fileSize:
+            self.close()
+            raise RegionFileError('Region file %s is truncated!' % self._filename)
+
+        self._mmap = mmap.mmap(self._fileobj.fileno(), self.fileSize)
+
+    def readBlockData(self):
+        blockData = chunk.ChunkStore(self._width, self._height, self._depth)
+
+        for index in xrange(self.numChunks):
+            offset = self.HEADER_SIZE + index * self.CHUNK_VOLUME
+            blockData.setChunk(index, self._mmap[offset:offset + self.CHUNK_VOLUME])
+
+        return blockData
+
+    def writeChunks(self, chunks):
+        for index, data in chunks:
+            offset = self.HEADER_SIZE + index * self.CHUNK_VOLUME
+            self._mmap[offset:offset + self.CHUNK_VOLUME] = data
+
+        # only the pages of the chunks written above are dirty, so this
+        # flushes them and nothing else.
+        self._mmap.flush()
+
+    def close(self):
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+
+        if self._fileobj:
+            self._fileobj.close()
+            self._fileobj = None
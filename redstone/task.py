@@ -5,8 +5,12 @@
 """
 
 import enum
-import time
-import threading
+import heapq
+import itertools
+
+from twisted.internet import reactor
+
+import redstone.logging as logging
 
 
 class TaskError(RuntimeError):
@@ -44,7 +48,8 @@ class Task(object):
 
         self._delay = delay
         self._can_delay = True
-        self._timestamp = self.get_timestamp()
+        self._due = 0
+        self._entry = None
 
         self._state = TaskState.WAITING
         self._last_state = None
@@ -81,6 +86,18 @@ class Task(object):
     def can_delay(self, can_delay):
         self._can_delay = can_delay
 
+    @property
+    def due(self):
+        return self._due
+
+    @property
+    def entry(self):
+        return self._entry
+
+    @entry.setter
+    def entry(self, entry):
+        self._entry = entry
+
     @property
     def state(self):
         return self._state
@@ -118,82 +135,63 @@ class Task(object):
     def cont(self):
         return TaskResult.CONT
 
-    def __cmp__(self, other_task):
-        """
-        Compares our task priorty value with the other task's priorty
-        value to see which has a higher priority...
-
-        Args:
-            Task: The other task instance to compare to
-
-        Returns:
-            Int: Comparison result
-        """
-
-        return cmp(self._priority, other_task.priority)
-
-    def get_timestamp(self):
+    def setup(self):
         """
-        Gets the current timestamp in epoch form and rounds the integer
-        decimal place...
+        Sets up the current task instance, this method can be overidden
+        by the user to initialize anything...
 
         Args:
             None
 
         Returns:
-            float: Timestamp value in epoch form
+            None
         """
 
-        return round(time.time(), 2)
-
-    def setup(self):
+    def schedule(self, due):
         """
-        Sets up the current task instance, this method can be overidden
-        by the user to initialize anything...
+        Sets the time at which the task is due to run next, the task manager
+        uses this value to order it's queue of pending tasks...
 
         Args:
-            None
+            Float: The due time in seconds, on the task manager's clock
 
         Returns:
             None
         """
 
+        self._due = due
+
     def run(self):
         """
-        Attempts to run the current task function specified by the user,
-        if their is a delay set for this task and the correct amount of time
-        according to the delay value has not passed, then the task will not be ran...
+        Runs the current task function specified by the user, the task manager
+        only calls this once the task is due and then schedules the task again
+        according to the result the function returned...
 
         Args:
             None
 
         Returns:
-            None
+            TaskResult: The result returned by the task function
         """
 
-        if self._can_delay and self.get_timestamp() - self._timestamp < self._delay:
-            return
-
         self.state = TaskState.RUNNING
 
         try:
             result = self._function(self, *self._args, **self._kwargs)
         except Exception as e:
             raise TaskError(e)
+        finally:
+            self.state = TaskState.WAITING
 
-        if result == TaskResult.DONE:
-            self._task_manager.remove_task(self)
-        elif result == TaskResult.WAIT:
+        if result == TaskResult.WAIT:
             self._can_delay = True
-            self._timestamp = self.get_timestamp()
         elif result == TaskResult.CONT:
             self._can_delay = False
-            self._timestamp = 0
-        else:
+        elif result != TaskResult.DONE:
             raise TaskError('Cannot handle invalid task result <%r>!' % (
                 result))
 
-        self.state = TaskState.WAITING
+        return result
 
     def destroy(self):
         """
@@ -213,7 +211,8 @@ class Task(object):
 
         self._delay = 0
         self._can_delay = False
-        self._timestamp = 0
+        self._due = 0
+        self._entry = None
 
         self._function = None
         self._args = None
@@ -221,15 +220,21 @@ class Task(object):
 
 class TaskManager(object):
     """
-    An task manager is an class that manages all task instances,
-    this acts as a round robin scheduler for asynchronous programming
-    utilizing threads...
+    An task manager is an class that manages all task instances, pending
+    tasks are kept in a priority queue ordered by the time they are due and
+    ran on the reactor thread when that time comes...
     """
 
-    def __init__(self):
+    def __init__(self, clock=None):
         self._tasks = {}
         self._shutdown = False
 
+        self._clock = clock or reactor
+        self._queue = []
+        self._counter = itertools.count()
+        self._delayed_call = None
+        self._running = False
+
     @property
     def tasks(self):
         return self._tasks
@@ -242,6 +247,9 @@ class TaskManager(object):
     def shutdown(self, shutdown):
         self._shutdown = shutdown
 
+        if shutdown:
+            self.destroy()
+
     def has_task(self, task_name):
         return task_name in self._tasks
 
@@ -273,6 +281,7 @@ class TaskManager(object):
         self._tasks[task_name] = task
         task.setup()
 
+        self.__schedule(task, delay)
         return task
 
     def remove_task(self, task):
@@ -292,8 +301,28 @@ class TaskManager(object):
             raise TaskError('Failed to remove an non-existant task <%s>!' % (
                 task.name))
 
-        task.destroy()
+        self.__cancel(task)
         del self._tasks[task.name]
+        task.destroy()
+
+    def reschedule_task(self, task, delay):
+        """
+        Changes when a task will run next, the task will run once the
+        specified delay has passed regardless of when it was due before...
+
+        Args:
+            Task: The task instance to be rescheduled
+            Float: The delay in seconds from now
+
+        Returns:
+            None
+        """
+
+        if not self.has_task(task.name):
+            raise TaskError('Failed to reschedule an non-existant task <%s>!' % (
+                task.name))
+
+        self.__schedule(task, delay)
 
     def get_task(self, task_name):
         """
@@ -320,28 +349,50 @@ class TaskManager(object):
             None
         """
 
-    def __update(self):
+    def __schedule(self, task, delay):
         """
-        Called by the task manager's main loop, this sorts the task instances by
-        priority and then runs each task until it is complete...
+        Pushes a task onto the priority queue so that it runs once the delay
+        has passed, any entry the task already had in the queue is cancelled...
 
         Args:
+            Task: The task instance to be scheduled
+            Float: The delay in seconds from now
+
+        Returns:
             None
+        """
+
+        self.__cancel(task)
+        task.schedule(self._clock.seconds() + delay)
+
+        entry = [task.due, task.priority, next(self._counter), task]
+        task.entry = entry
+
+        heapq.heappush(self._queue, entry)
+        self.__wakeup()
+
+    def __cancel(self, task):
+        """
+        Removes a task from the priority queue, the queue entry is only marked
+        as cancelled here and is discarded once it reaches the top of the heap...
+
+        Args:
+            Task: The task instance to be cancelled
 
         Returns:
             None
         """
 
-        pending_tasks = sorted([task for task in self._tasks.values() \
-            if task.state == TaskState.WAITING])
+        if task.entry is None:
+            return
 
-        for task in pending_tasks:
-            task.run()
+        task.entry[-1] = None
+        task.entry = None
 
-    def run(self):
+    def __wakeup(self):
         """
-        This is the task manager's main loop which is also the applications
-        mainloop, every event in the application is ran by the task manager here...
+        Makes sure the reactor calls back into the task manager when the
+        next task in the priority queue is due...
 
         Args:
             None
@@ -350,22 +401,98 @@ class TaskManager(object):
             None
         """
 
-        def mainloop():
-            self.setup()
+        if not self._running or self._shutdown:
+            return
 
-            while not self._shutdown:
-                try:
-                    self.__update()
-                except (KeyboardInterrupt, SystemExit):
-                    self._shutdown = True
+        # drop any cancelled entries from the top of the queue.
+        while self._queue and self._queue[0][-1] is None:
+            heapq.heappop(self._queue)
 
-                time.sleep(0.01)
+        if not self._queue:
+            if self._delayed_call and self._delayed_call.active():
+                self._delayed_call.cancel()
 
-            self.destroy()
+            self._delayed_call = None
+            return
+
+        delay = max(0, self._queue[0][0] - self._clock.seconds())
+
+        if self._delayed_call and self._delayed_call.active():
+            if self._delayed_call.getTime() != self._queue[0][0]:
+                self._delayed_call.reset(delay)
+
+            return
+
+        self._delayed_call = self._clock.callLater(delay, self.__update)
+
+    def __update(self):
+        """
+        Called by the reactor once the task at the top of the priority queue
+        is due, this runs every task that is due and schedules it again...
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        self._delayed_call = None
+        now = self._clock.seconds()
+        pending_tasks = []
+
+        while self._queue and self._queue[0][0] <= now:
+            task = heapq.heappop(self._queue)[-1]
+
+            if task is None:
+                continue
+
+            task.entry = None
+            pending_tasks.append(task)
+
+        for task in pending_tasks:
+            if self._shutdown:
+                break
 
-        thread = threading.Thread(target=mainloop)
-        thread.daemon = True
-        thread.start()
+            # the task may have been removed by another task ran before it.
+            if self._tasks.get(task.name) is not task or task.entry is not None:
+                continue
+
+            try:
+                result = task.run()
+            except TaskError as e:
+                logging.Logger.error('Task <%s> failed: %s', task.name, e)
+                result = TaskResult.WAIT
+
+            if self._tasks.get(task.name) is not task or task.entry is not None:
+                continue
+
+            if result == TaskResult.DONE:
+                self.remove_task(task)
+            elif result == TaskResult.WAIT:
+                self.__schedule(task, task.delay)
+            else:
+                self.__schedule(task, 0)
+
+        self.__wakeup()
+
+    def run(self):
+        """
+        Starts the task manager, tasks are ran by the reactor as they become
+        due so the task manager never blocks and never runs at the same time
+        as any other event in the application...
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        self.setup()
+
+        self._running = True
+        self.__wakeup()
 
     def destroy(self):
         """
@@ -379,4 +506,11 @@ class TaskManager(object):
             None
         """
 
+        if self._delayed_call and self._delayed_call.active():
+            self._delayed_call.cancel()
+
+        self._delayed_call = None
+        self._running = False
+
         self._tasks = {}
+        self._queue = []
@@ -37,8 +37,14 @@ class DataBuffer(object):
         self.write(struct.pack('!%s' % fmt, *args))
 
     def read(self, length):
-        data = self._data[self._offset:][:length]
+        data = self._data[self._offset:self._offset + length]
         self._offset += length
+
+        # reading from a memoryview yields another view, copy out just
+        # the bytes that were requested.
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+
         return data
 
     def clear(self):
@@ -80,6 +86,14 @@ class DataBuffer(object):
     def writeArray(self, array, length=1024):
         self.write(array + bytes().join(['\x00'] * (length - len(array))))
 
+def padString(string, length=64):
+    # strings in the classic protocol are a fixed length and padded with spaces,
+    # world names loaded from json are unicode so encode them first...
+    if isinstance(string, unicode):
+        string = string.encode('ascii', 'replace')
+
+    return string[:length].ljust(length)
+
 def clamp(value, minV, maxV):
     return max(minV, min(value, maxV))
 
@@ -105,6 +119,39 @@ def generateRandomSalt(length=16):
 
     return ''.join(chars)
 
+class LatencyStats(object):
+    """
+    Keeps simple running statistics of how long an operation took
+    """
+
+    def __init__(self):
+        self._count = 0
+        self._total = 0.0
+        self._last = 0.0
+        self._maximum = 0.0
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def last(self):
+        return self._last
+
+    @property
+    def maximum(self):
+        return self._maximum
+
+    @property
+    def average(self):
+        return self._total / self._count if self._count else 0.0
+
+    def record(self, seconds):
+        self._count += 1
+        self._total += seconds
+        self._last = seconds
+        self._maximum = max(self._maximum, seconds)
+
 class Mouse(object):
     LEFT_CLICK = 0
     RIGHT_CLICK = 1
@@ -158,6 +205,9 @@ class BlockIds(object):
     GOLD_ORE = 14
     IRON_ORE = 15
     COAL_ORE = 16
+    LOG = 17
+    LEAVES = 18
+    GLASS = 20
 
     @classmethod
     def hasBlockId(cls, blockId):
@@ -8,12 +8,23 @@ import struct
 import gzip
 import io
 import os
+import zlib
 import json
+import time
+import itertools
+import threading
+import collections
+
+from twisted.internet import defer, threads
+from twisted.python import failure
 
 import redstone.logging as logging
 import redstone.entity as entity
 import redstone.packet as packet
 import redstone.block as block
+import redstone.chunk as chunk
+import redstone.region as region
+import redstone.compression as compression
 import redstone.util as util
 
 
@@ -38,17 +49,322 @@ def decompress(data):
 
     return data
 
+class WorldSnapshot(object):
+    CHUNK_SIZE = 1024
+
+    def __init__(self, version, data, blockData):
+        self._version = version
+        self._data = data
+        self._blockData = blockData
+        self._chunks = [data[i: i + self.CHUNK_SIZE] for i in xrange(0, len(data),
+            self.CHUNK_SIZE)]
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def blockData(self):
+        return self._blockData
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+class WorldSnapshotCache(object):
+
+    def __init__(self, world):
+        self._world = world
+        self._snapshot = None
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def getValidSnapshot(self):
+        # returns the snapshot if no block has changed since it was taken.
+        if self._snapshot and self._snapshot.version == self._world.version:
+            self._hits += 1
+            return self._snapshot
+
+        self._misses += 1
+        return None
+
+    def setSnapshot(self, version, data, blockData):
+        # a snapshot compressed elsewhere (e.g. by a save) can be reused
+        # as long as no block has changed since.
+        if version != self._world.version:
+            return
+
+        self._snapshot = WorldSnapshot(version, data, blockData)
+
+    def invalidate(self):
+        self._snapshot = None
+
+class LevelStream(object):
+    """
+    Compresses a world's blocks while they're being sent to a player, each
+    piece of compressed data is yielded as soon as there's enough of it
+    """
+
+    CHUNK_SIZE = WorldSnapshot.CHUNK_SIZE
+
+    def __init__(self, world, compresslevel):
+        self._world = world
+        self._compresslevel = compresslevel
+        self._blockData = None
+
+    @property
+    def blockData(self):
+        return self._blockData
+
+    def __iter__(self):
+        """
+        Yields (chunk, percent) for every piece of the level, chunk is None
+        when a layer of blocks didn't produce a whole piece yet
+        """
+
+        snapshot = self._world.snapshotCache.getValidSnapshot()
+
+        if snapshot:
+            self._blockData = snapshot.blockData
+            numChunks = len(snapshot.chunks)
+
+            for chunkCount, chunk in enumerate(snapshot.chunks):
+                yield chunk, chunkCount * 100 / numChunks
+
+            return
+
+        # compress a copy on write snapshot of the blocks as they were when
+        # the player joined, the world may change while it's being sent.
+        version = self._world.version
+        blockData = self._blockData = self._world.blockData.snapshot()
+
+        compressor = zlib.compressobj(self._compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        pending = bytearray(compressor.compress(struct.pack('!I', blockData.volume)))
+        chunks = []
+
+        for y, blocks in enumerate(blockData.iterBlockData()):
+            pending += compressor.compress(blocks)
+            percent = y * 100 / blockData.height
+
+            if len(pending) < self.CHUNK_SIZE:
+                yield None, percent
+                continue
+
+            while len(pending) >= self.CHUNK_SIZE:
+                chunks.append(bytes(pending[:self.CHUNK_SIZE]))
+                del pending[:self.CHUNK_SIZE]
+
+                yield chunks[-1], percent
+
+        pending += compressor.flush()
+
+        for offset in xrange(0, len(pending), self.CHUNK_SIZE):
+            chunks.append(bytes(pending[offset:offset + self.CHUNK_SIZE]))
+            yield chunks[-1], 100
+
+        # the next player to join can reuse the compressed level if nothing
+        # has changed in the meantime.
+        self._world.snapshotCache.setSnapshot(version, bytes().join(chunks), blockData)
+
+class WorldJournal(object):
+    """
+    An append only journal of the blocks changed in a world since it was
+    last saved, replayed on top of the world file when the world is loaded
+    """
+
+    RECORD = struct.Struct('!HHHB')
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._oldFilename = '%s.old' % filename
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._fileobj = open(filename, 'ab')
+
+        # buffers taken by a sync or rotate that haven't been written yet, in
+        # the order they were taken. the worker threads write them in order,
+        # close writes whatever they didn't get to.
+        self._pending = collections.deque()
+        self._deferred = defer.succeed(None)
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def oldFilename(self):
+        return self._oldFilename
+
+    def append(self, x, y, z, blockId):
+        self._buffer += self.RECORD.pack(x, y, z, blockId)
+
+    def replay(self, world):
+        # the old journal holds the changes of a checkpoint that may not have
+        # finished, replaying a record twice is harmless so both are applied.
+        numRecords = 0
+
+        for filename in (self._oldFilename, self._filename):
+            if not os.path.exists(filename):
+                continue
+
+            with open(filename, 'rb') as fileobj:
+                data = fileobj.read()
+
+            # a torn record at the end of the journal was never synced, skip it.
+            for offset in xrange(0, len(data) - len(data) % self.RECORD.size, self.RECORD.size):
+                x, y, z, blockId = self.RECORD.unpack_from(data, offset)
+
+                if not world.blockInRange(x, y, z):
+                    continue
+
+                world.setBlock(x, y, z, blockId, update=False)
+                numRecords += 1
+
+        return numRecords
+
+    def __queue(self, function, *args):
+        # journal file operations must happen in order, so each one is only
+        # handed to a worker thread once the previous one has finished.
+        self._deferred.addCallback(lambda _: threads.deferToThread(function, *args))
+        self._deferred.addErrback(self.__failed)
+
+    def __failed(self, result):
+        logging.Logger.error('Failed to write journal [%s]: %s', self._filename,
+            result.getErrorMessage())
+
+    def __takeBuffer(self):
+        data = bytes(self._buffer)
+        del self._buffer[:]
+
+        self._pending.append(data)
+
+    def sync(self):
+        if not self._buffer:
+            return
+
+        self.__takeBuffer()
+        self.__queue(self.__write)
+
+    def __write(self):
+        with self._lock:
+            if not self._fileobj:
+                return
+
+            self._fileobj.write(self._pending.popleft())
+            self._fileobj.flush()
+            os.fsync(self._fileobj.fileno())
+
+    def rotate(self):
+        # a checkpoint of the world has just been taken, every change journaled
+        # so far is part of it and is moved aside until the checkpoint is on disk.
+        self.__takeBuffer()
+        self.__queue(self.__rotate)
+
+    def __rotate(self):
+        with self._lock:
+            if not self._fileobj:
+                return
+
+            self._fileobj.write(self._pending.popleft())
+            self._fileobj.flush()
+            os.fsync(self._fileobj.fileno())
+            self._fileobj.close()
+
+            if not os.path.exists(self._oldFilename):
+                os.rename(self._filename, self._oldFilename)
+                self._fileobj = open(self._filename, 'ab')
+                return
+
+            # the previous checkpoint failed, so its changes are still needed
+            # and the current journal is appended to them instead.
+            with open(self._filename, 'rb') as fileobj:
+                data = fileobj.read()
+
+            with open(self._oldFilename, 'ab') as fileobj:
+                fileobj.write(data)
+                fileobj.flush()
+                os.fsync(fileobj.fileno())
+
+            self._fileobj = open(self._filename, 'wb')
+
+    def checkpoint(self):
+        # the checkpoint is on disk, the changes moved aside are no longer needed.
+        self.__queue(self.__checkpoint)
+
+    def __checkpoint(self):
+        with self._lock:
+            if os.path.exists(self._oldFilename):
+                os.remove(self._oldFilename)
+
+    def stop(self):
+        # close the journal once everything queued before has finished.
+        self.sync()
+        self.__queue(self.close)
+
+        return self._deferred
+
+    def close(self):
+        # write out anything left synchronously, used when shutting down. the
+        # buffers still waiting on a worker thread are written first.
+        with self._lock:
+            if not self._fileobj:
+                return
+
+            self.__takeBuffer()
+
+            while self._pending:
+                self._fileobj.write(self._pending.popleft())
+
+            self._fileobj.flush()
+            os.fsync(self._fileobj.fileno())
+            self._fileobj.close()
+            self._fileobj = None
+
 class World(object):
     WIDTH = 256
     HEIGHT = 64
     DEPTH = 256
+    GROUND_LEVEL = 32
 
-    def __init__(self, worldManager, name, blockData=None):
+    def __init__(self, worldManager, name, blockData=None, width=WIDTH, height=HEIGHT, depth=DEPTH):
         self._worldManager = worldManager
         self._name = name
-        self._entityManager = entity.EntityManager()
+        self._width = width
+        self._height = height
+        self._depth = depth
+        self._entityManager = entity.EntityManager(worldManager.viewRadius)
         self._physicsManager = block.BlockPhysicsManager(self)
+        self._fluidManager = block.BlockFluidManager(self)
+        self._randomTickManager = block.BlockRandomTickManager(self)
+        self._movementManager = entity.EntityMovementManager(self)
+        self._blockChangeQueue = block.BlockChangeQueue(self)
         self._blockData = blockData if blockData else self.__generate()
+        self._version = 0
+        self._snapshotCache = WorldSnapshotCache(self)
+        self._protocols = set()
+        self._journal = None
+        self._region = None
+        self._lastActive = time.time()
+
+        # one byte per chunk, set whenever a block in the chunk changes
+        # so the region file only has to rewrite the chunks that changed.
+        self._dirtyChunks = bytearray(self._blockData.numChunks)
 
     @property
     def worldManager(self):
@@ -70,80 +386,210 @@ class World(object):
     def physicsManager(self):
         return self._physicsManager
 
+    @property
+    def fluidManager(self):
+        return self._fluidManager
+
+    @property
+    def randomTickManager(self):
+        return self._randomTickManager
+
+    @property
+    def blockChangeQueue(self):
+        return self._blockChangeQueue
+
+    @property
+    def movementManager(self):
+        return self._movementManager
+
+    @property
+    def protocols(self):
+        return self._protocols
+
+    @property
+    def snapshotCache(self):
+        return self._snapshotCache
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def blockData(self):
+        return self._blockData
+
+    @property
+    def journal(self):
+        return self._journal
+
+    @journal.setter
+    def journal(self, journal):
+        self._journal = journal
+
+    @property
+    def region(self):
+        return self._region
+
+    @region.setter
+    def region(self, region):
+        self._region = region
+
+    @property
+    def dirtyChunks(self):
+        return self._dirtyChunks
+
+    @property
+    def lastActive(self):
+        return self._lastActive
+
+    def isIdle(self, timeout):
+        return not self._protocols and time.time() - self._lastActive >= timeout
+
     @property
     def width(self):
-        return self.WIDTH
+        return self._width
 
     @property
     def height(self):
-        return self.HEIGHT
+        return self._height
 
     @property
     def depth(self):
-        return self.DEPTH
+        return self._depth
+
+    @property
+    def groundLevel(self):
+        return min(self.GROUND_LEVEL, self._height // 2)
 
     def __generate(self):
-        blockData = bytearray(self.WIDTH * self.HEIGHT * self.DEPTH)
+        blockData = chunk.ChunkStore(self._width, self._height, self._depth)
+
+        # the terrain is the same for every chunk in a layer of chunks, so
+        # each layer shares a single chunk until a block in it is changed.
+        groundLevel = self.groundLevel
+        layerChunk = bytearray(chunk.CHUNK_VOLUME)
+
+        for cy in xrange(((self._height - 1) >> chunk.CHUNK_SHIFT) + 1):
+            for ly in xrange(chunk.CHUNK_SIZE):
+                y = (cy << chunk.CHUNK_SHIFT) + ly
+
+                if y < groundLevel:
+                    blockId = util.BlockIds.DIRT
+                elif y == groundLevel:
+                    blockId = util.BlockIds.GRASS
+                else:
+                    blockId = util.BlockIds.AIR
 
-        for x in range(self.WIDTH):
-            for y in range(self.HEIGHT):
-                for z in range(self.DEPTH):
-                    blockData[x + self.DEPTH * (z + self.WIDTH * y)] = 0 if y > 32 else \
-                        (2 if y == 32 else 3)
+                layerChunk[ly * chunk.CHUNK_AREA:(ly + 1) * chunk.CHUNK_AREA] = chr(blockId) * chunk.CHUNK_AREA
+
+            blockData.fillChunkLayer(cy, layerChunk)
 
         return blockData
 
     def getBlock(self, x, y, z):
-        return self._blockData[x + self.DEPTH * (z + self.WIDTH * y)]
+        return self._blockData.getBlock(x, y, z)
 
     def setBlock(self, x, y, z, blockId, update=True):
-        self._blockData[x + self.DEPTH * (z + self.WIDTH * y)] = blockId
+        self._dirtyChunks[self._blockData.setBlock(x, y, z, blockId)] = 1
+        self._version += 1
+
+        if self._journal:
+            self._journal.append(x, y, z, blockId)
 
-        # a block has just been placed, tell the physics manager
-        # incase the block has physics and needs to be updated
+        # a block has changed, tell the physics manager so the block
+        # and the blocks around it are updated on the next tick.
         if update:
             self._physicsManager.updateBlock(x, y, z, blockId)
+            self._fluidManager.updateBlock(x, y, z, blockId)
 
     def blockInRange(self, x, y, z):
-        return x <= self.WIDTH - 1 and x >= 0 and y <= self.HEIGHT - 1 and y >= 0 and z >= 0 and z <= self.DEPTH - 1
+        return x <= self._width - 1 and x >= 0 and y <= self._height - 1 and y >= 0 and z >= 0 and z <= self._depth - 1
 
-    def serialize(self):
-        return compress(struct.pack('!I', len(self._blockData)) + bytes(self._blockData))
+    def serialize(self, compressor=None):
+        return self.serializeBlockData(self._blockData, compressor=compressor)
+
+    def getLevelStream(self, compresslevel=9):
+        return LevelStream(self, compresslevel)
+
+    @staticmethod
+    def serializeBlockData(blockData, compresslevel=9, compressor=None):
+        # compress the blocks as they're streamed out of the chunk store,
+        # the whole level is never held in memory uncompressed.
+        if compressor:
+            return compressor.compress(itertools.chain([struct.pack('!I', blockData.volume)],
+                blockData.iterBlockData()), compresslevel)
+
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        data = [compressor.compress(struct.pack('!I', blockData.volume))]
+
+        for blocks in blockData.iterBlockData():
+            data.append(compressor.compress(blocks))
+
+        data.append(compressor.flush())
+        return bytes().join(data)
+
+    def isFull(self):
+        return self._entityManager.allocator.full
 
     def addPlayer(self, protocol, username):
+        entityId = self._entityManager.allocator.allocate()
+
+        # every entity id is taken, the player can't join this world.
+        if entityId is None:
+            logging.Logger.warning('%s can\'t join world %s, the world is full!', username, self.name)
+            return None
+
         playerEntity = entity.PlayerEntity(protocol)
-        playerEntity.id = self._entityManager.allocator.allocate()
+        playerEntity.id = entityId
         playerEntity.username = username
         playerEntity.world = self.name
 
         playerEntity.x = 33
-        playerEntity.y = 34
+        playerEntity.y = self.groundLevel + 2
         playerEntity.z = 33
 
+        # the world manager's indices are updated first, if that fails the
+        # entity id is freed and nothing else has changed.
+        try:
+            self._worldManager.registerPlayer(self, playerEntity)
+        except Exception:
+            self._entityManager.allocator.deallocate(playerEntity.id)
+            raise
+
         # set the protocols entity object
         protocol.entity = playerEntity
 
         # add the player entity to the entity manager
         self._entityManager.addEntity(playerEntity)
 
-        logging.Logger.info('%s joined world %s' % (playerEntity.username, self.name))
+        # the protocol now receives everything broadcasted to this world
+        self._protocols.add(protocol)
+        self._lastActive = time.time()
+
+        logging.Logger.info('%s joined world %s', playerEntity.username, self.name)
 
         # broadcast the player joined message
         protocol.factory.broadcast(packet.ServerMessage.DIRECTION, packet.ServerMessage.ID, [], protocol.entity.id, '%s%s joined the game.%s' % (
             util.ChatColors.BLUE, protocol.entity.username, util.ChatColors.WHITE))
 
+        return playerEntity
+
     def removePlayer(self, protocol):
+        # stop sending world broadcasts to the protocol
+        self._protocols.discard(protocol)
+        self._lastActive = time.time()
+        self._worldManager.unregisterPlayer(self, protocol.entity)
+
         # remove the protocols entity from the entity manager
         self._entityManager.removeEntity(protocol.entity)
 
         # free the entity id
         self._entityManager.allocator.deallocate(protocol.entity.id)
 
-        # update all entities for all players except for the entities owner.
-        self._worldManager.broadcast(self, packet.DespawnPlayer.DIRECTION, packet.DespawnPlayer.ID,
-            [protocol], protocol.entity)
+        # despawn the entity for every player that can currently see it.
+        self._movementManager.removeEntity(protocol.entity)
 
-        logging.Logger.info('%s left world %s' % (protocol.entity.username, self.name))
+        logging.Logger.info('%s left world %s', protocol.entity.username, self.name)
 
         # broadcast the leaving message
         protocol.factory.broadcast(packet.ServerMessage.DIRECTION, packet.ServerMessage.ID, [], protocol.entity.id, '%s%s left the game.%s' % (
@@ -153,43 +599,82 @@ class World(object):
         protocol.entity = None
 
     def updatePlayers(self, protocol):
-        for entity in self._entityManager.entities.values():
-            if entity.world != self.name or entity.id == protocol.entity.id:
-                continue
+        playerEntity = protocol.entity
+
+        # send the player their own entity first, the players within their
+        # view radius are spawned for each other on the next world tick.
+        protocol.dispatcher.handleDispatch(packet.SpawnPlayer.DIRECTION, packet.SpawnPlayer.ID, playerEntity)
 
-            protocol.dispatcher.handleDispatch(packet.SpawnPlayer.DIRECTION, packet.SpawnPlayer.ID, entity)
+        playerEntity.spawned = True
+        self._movementManager.resetEntity(playerEntity)
+        self._movementManager.markDirty(playerEntity)
 
-        # now send update for owned entity
-        self._worldManager.broadcast(self, packet.SpawnPlayer.DIRECTION, packet.SpawnPlayer.ID, [], protocol.entity)
+    def update(self):
+        self._movementManager.update()
+        self._physicsManager.update()
+        self._fluidManager.update()
+        self._randomTickManager.update(self._worldManager.randomTickSpeed)
+        self._blockChangeQueue.flush()
 
     def save(self):
-        self._worldManager.write(self._worldManager.getFilePath(self.name), 'wb',
-            self.serialize())
+        return self._worldManager.saveWorld(self)
 
     @staticmethod
-    def load(data):
+    def load(data, width=WIDTH, height=HEIGHT, depth=DEPTH):
         unpacked = decompress(data)
         payloadLength = struct.unpack('!I', unpacked[:4])[0]
-        payload = unpacked[4:]
 
-        if payloadLength != len(payload):
+        if payloadLength != len(unpacked) - 4 or payloadLength != width * height * depth:
             raise ValueError('Invalid world data file!')
 
-        return bytearray(payload)
+        return chunk.ChunkStore.fromBytes(width, height, depth, buffer(unpacked, 4))
 
 class WorldManagerIOError(Exception):
     pass
 
+class WorldManagerError(Exception):
+    pass
+
+class WorldSave(object):
+    """
+    Keeps track of the save in progress for a world and the callers
+    waiting on it, or on the save queued to run after it
+    """
+
+    def __init__(self):
+        self.running = False
+        self.queued = False
+        self.deferreds = []
+        self.queuedDeferreds = []
+
 class WorldManagerIO(object):
 
     def __init__(self):
         self._directory = 'worlds'
         self._filename = '%s/properties.json' % self._directory
         self._mainWorldName = 'main'
+        self._worldNames = []
+        self._worldDimensions = {}
+
+    @property
+    def worldNames(self):
+        return self._worldNames
+
+    def getWorldDimensions(self, worldName):
+        return self._worldDimensions.get(worldName, (World.WIDTH, World.HEIGHT, World.DEPTH))
 
     def getFilePath(self, worldName):
         return '%s/%s.dat' % (self._directory, worldName)
 
+    def getJournalPath(self, worldName):
+        return '%s/%s.journal' % (self._directory, worldName)
+
+    def getRegionPath(self, worldName):
+        return '%s/%s.region' % (self._directory, worldName)
+
+    def hasWorld(self, worldName):
+        return os.path.exists(self.getFilePath(worldName)) or os.path.exists(self.getRegionPath(worldName))
+
     def setup(self):
         # first setup the world directory and world properties
         if not os.path.exists(self._directory):
@@ -211,12 +696,20 @@ class WorldManagerIO(object):
 
         for worldName in jsonData['worlds']:
 
-            if not os.path.exists(self.getFilePath(worldName)):
-                # the world file wasn't found, generate a new world.
+            # a world is either just its name or an object which also
+            # has the dimensions of the world, e.g. for larger worlds.
+            if isinstance(worldName, dict):
+                properties, worldName = worldName, worldName['name']
+
+                self._worldDimensions[worldName] = (properties.get('width', World.WIDTH),
+                    properties.get('height', World.HEIGHT), properties.get('depth', World.DEPTH))
+
+            self._worldNames.append(worldName)
+
+            # the world file wasn't found, generate a new world. existing
+            # worlds are only loaded into memory once they're needed.
+            if not self.hasWorld(worldName):
                 self.create(worldName)
-            else:
-                # load the world into memory
-                self.load(worldName)
 
     def read(self, filename, mode):
         # open the specified file with the specified file mode
@@ -240,11 +733,35 @@ class WorldManagerIO(object):
             # close the file object instance
             fileobj.close()
 
+    def writeAtomic(self, filename, data):
+        # write the data to a temporary file first and then replace the file,
+        # a crash mid write should never leave a corrupted file behind.
+        tempFilename = '%s.tmp' % filename
+
+        with open(tempFilename, 'wb') as fileobj:
+            fileobj.write(data)
+            fileobj.flush()
+            os.fsync(fileobj.fileno())
+
+        os.rename(tempFilename, filename)
+
+        # make sure the rename itself is on disk as well.
+        if hasattr(os, 'O_DIRECTORY'):
+            directory = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY | os.O_DIRECTORY)
+
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+    def moveAside(self, filename):
+        os.rename(filename, '%s.converted' % filename)
+
     def create(self, worldName):
-        logging.Logger.info('Creating new world [%s]...' % worldName)
+        logging.Logger.info('Creating new world [%s]...', worldName)
 
     def load(self, worldName):
-        logging.Logger.info('Loading world [%s]...' % worldName)
+        logging.Logger.info('Loading world [%s]...', worldName)
 
     def delete(self, worldName):
         pass
@@ -261,40 +778,283 @@ class WorldManager(WorldManagerIO):
         super(WorldManager, self).__init__()
 
         self._factory = factory
-        self._worlds = {}
+
+        # the resident worlds, ordered from least to most recently used.
+        self._worlds = collections.OrderedDict()
+        self._unloading = {}
+        self._closing = set()
+        self._numPlayers = 0
+        self._usernames = {}
+        self._entityWorlds = {}
+        self._saves = {}
+        self._loadStats = util.LatencyStats()
+        self._unloadStats = util.LatencyStats()
+        self._levelFirstChunkStats = util.LatencyStats()
+        self._levelSendStats = util.LatencyStats()
+        self._compressor = compression.ParallelGzipCompressor(factory.daemon.compressionThreads)
 
     @property
     def factory(self):
         return self._factory
 
+    @property
+    def viewRadius(self):
+        return self._factory.daemon.viewRadius
+
+    @property
+    def worldFormat(self):
+        return self._factory.daemon.worldFormat
+
+    @property
+    def maxWorlds(self):
+        return self._factory.daemon.maxWorlds
+
+    @property
+    def worldIdleTimeout(self):
+        return self._factory.daemon.worldIdleTimeout
+
     @property
     def worlds(self):
         return self._worlds
 
+    @property
+    def levelCompression(self):
+        return self._factory.daemon.levelCompression
+
+    @property
+    def randomTickSpeed(self):
+        return self._factory.daemon.randomTickSpeed
+
+    @property
+    def compressor(self):
+        return self._compressor
+
+    @property
+    def loadStats(self):
+        return self._loadStats
+
+    @property
+    def unloadStats(self):
+        return self._unloadStats
+
+    @property
+    def levelFirstChunkStats(self):
+        return self._levelFirstChunkStats
+
+    @property
+    def levelSendStats(self):
+        return self._levelSendStats
+
+    @property
+    def numPlayers(self):
+        return self._numPlayers
+
     def broadcast(self, world, direction, packetId, exceptions, *args, **kw):
+        # since we're broadcasting a specific message from a specific
+        # world, only send it to the protocols connected to that world.
+        self._factory.broadcastTo(world.protocols, direction, packetId, exceptions,
+            *args, **kw)
 
-        for protocol in self._factory.protocols:
-            # since we're broadcasting a specific message from a specific
-            # world, we dont want to send data to anyone in a different world.
-            if not protocol.entity:
-                continue
+    def update(self):
+        for world in self._worlds.values():
+            world.update()
 
-            if protocol.entity.world != world.name:
-                exceptions.append(protocol)
+    def syncJournals(self):
+        for world in self._worlds.values() + self._unloading.values():
+            if world.journal:
+                world.journal.sync()
 
-        self._factory.broadcast(direction, packetId, exceptions, *args, **kw)
+    def closeJournals(self):
+        for world in self._worlds.values() + self._unloading.values():
+            if world.journal:
+                world.journal.close()
 
-    def getMainWorld(self):
-        return self._worlds[self._mainWorldName]
+    def setup(self):
+        super(WorldManager, self).setup()
 
-    def getWorldFromEntity(self, entityId):
+        # players always join the main world first, so it's loaded right away.
+        self.getMainWorld()
+
+    def unloadIdleWorlds(self):
         for world in self._worlds.values():
-            if not world.entityManager.hasEntity(entityId):
+            if world.name == self._mainWorldName:
                 continue
 
-            return world
+            if world.isIdle(self.worldIdleTimeout):
+                self.unloadWorld(world)
 
-        return None
+    def evictWorlds(self, keepWorld):
+        # unload the least recently used worlds nobody is in until the
+        # number of resident worlds is within the limit again.
+        numWorlds = len(self._worlds)
+
+        for world in self._worlds.values():
+            if numWorlds <= self.maxWorlds:
+                break
+
+            if world is keepWorld or world.name == self._mainWorldName or world.protocols:
+                continue
+
+            self.unloadWorld(world)
+            numWorlds -= 1
+
+        if numWorlds > self.maxWorlds:
+            logging.Logger.debug('There are %d worlds loaded, every world over the limit of %d is in use!',
+                numWorlds, self.maxWorlds)
+
+    def unloadWorld(self, world):
+        logging.Logger.info('Unloading world [%s]...', world.name)
+
+        # the world stays in memory until it's saved, if it's needed again
+        # before then it's simply made resident again.
+        self.removeWorld(world)
+        self._unloading[world.name] = world
+
+        deferred = world.save()
+        deferred.addCallback(self.__closeWorld, time.time())
+        deferred.addErrback(self.__unloadFailed, world)
+
+    def __closeWorld(self, world, startTime):
+        if self._unloading.get(world.name) is not world:
+            return
+
+        self._closing.add(world.name)
+
+        # close the journal only once everything queued on it is on disk,
+        # the world can't be loaded again until then.
+        deferred = world.journal.stop() if world.journal else defer.succeed(None)
+        deferred.addCallback(lambda _: self.__finishUnload(world, startTime))
+
+    def __finishUnload(self, world, startTime):
+        if world.region:
+            world.region.close()
+
+        del self._unloading[world.name]
+        self._closing.discard(world.name)
+        self._unloadStats.record(time.time() - startTime)
+
+        logging.Logger.info('Unloaded world [%s] in %.2f ms.', world.name,
+            self._unloadStats.last * 1000.0)
+
+    def __unloadFailed(self, result, world):
+        logging.Logger.error('Failed to unload world [%s]: %s', world.name, result.getErrorMessage())
+
+        # keep the world in memory, it'll be unloaded once it's idle again.
+        if self._unloading.get(world.name) is world:
+            del self._unloading[world.name]
+            self.addWorld(world)
+
+    def createRegion(self, world):
+        worldRegion = region.RegionFile(self.getRegionPath(world.name), world.width, world.height,
+            world.depth)
+
+        worldRegion.create(world.blockData)
+        world.region = worldRegion
+
+    def openJournal(self, world):
+        # replay any changes made since the world was last saved, before the
+        # journal is attached so the replayed changes aren't journaled again.
+        journal = WorldJournal(self.getJournalPath(world.name))
+        numRecords = journal.replay(world)
+
+        if numRecords:
+            logging.Logger.info('Replayed %d block changes from journal [%s]...', numRecords,
+                world.name)
+
+        world.journal = journal
+
+    def saveWorld(self, world):
+        """
+        Saves a world in the background and returns a deferred which fires
+        once the world is on disk, saves requested while the same world is
+        already being saved are coalesced into a single save that runs next
+        """
+
+        deferred = defer.Deferred()
+        worldSave = self._saves.setdefault(world.name, WorldSave())
+
+        if worldSave.running:
+            worldSave.queued = True
+            worldSave.queuedDeferreds.append(deferred)
+        else:
+            worldSave.deferreds.append(deferred)
+            self.__startSave(world, worldSave)
+
+        return deferred
+
+    def __startSave(self, world, worldSave):
+        worldSave.running = True
+
+        # copy the block data on the reactor thread, this is cheap compared
+        # to compressing it which happens in a worker thread. if the level is
+        # already compressed for joining players that snapshot is written as is.
+        version = world.version
+        snapshot = world.snapshotCache.snapshot
+
+        if world.journal:
+            world.journal.rotate()
+
+        if world.region:
+            # only the chunks changed since the last save are copied and written.
+            chunks = world.region.getDirtyChunks(world.blockData, world.dirtyChunks)
+
+            deferred = threads.deferToThread(world.region.writeChunks, chunks)
+            deferred.addErrback(self.__restoreDirtyChunks, world, chunks)
+        elif snapshot and snapshot.version == version:
+            deferred = threads.deferToThread(self.writeAtomic, self.getFilePath(world.name),
+                snapshot.data)
+        else:
+            blockData = world.blockData.snapshot()
+
+            deferred = threads.deferToThread(self.__writeWorld, self.getFilePath(world.name),
+                blockData)
+
+            deferred.addCallback(lambda data: world.snapshotCache.setSnapshot(version, data, blockData))
+
+        deferred.addBoth(self.__finishSave, world, worldSave)
+
+    def __restoreDirtyChunks(self, result, world, chunks):
+        # the chunks were never written, so the next save has to write them.
+        for index, _ in chunks:
+            world.dirtyChunks[index] = 1
+
+        return result
+
+    def __writeWorld(self, filename, blockData):
+        data = World.serializeBlockData(blockData, compressor=self._compressor)
+        self.writeAtomic(filename, data)
+
+        return data
+
+    def __finishSave(self, result, world, worldSave):
+        worldSave.running = False
+        deferreds, worldSave.deferreds = worldSave.deferreds, []
+
+        if isinstance(result, failure.Failure):
+            logging.Logger.error('Failed to save world [%s]: %s', world.name, result.getErrorMessage())
+        elif world.journal:
+            # this must be queued before the next save rotates the journal again.
+            world.journal.checkpoint()
+
+        if worldSave.queued:
+            worldSave.queued = False
+            worldSave.deferreds, worldSave.queuedDeferreds = worldSave.queuedDeferreds, []
+            self.__startSave(world, worldSave)
+        else:
+            del self._saves[world.name]
+
+        for deferred in deferreds:
+            if isinstance(result, failure.Failure):
+                deferred.errback(result)
+            else:
+                deferred.callback(world)
+
+    def getMainWorld(self):
+        return self.getWorld(self._mainWorldName)
+
+    def getWorldFromEntity(self, entity):
+        # entity ids are only unique within a world, so the entity is used.
+        return self._entityWorlds.get(entity)
 
     def getEntityFromWorld(self, entityId):
         for world in self._worlds.values():
@@ -306,22 +1066,30 @@ class WorldManager(WorldManagerIO):
         return None
 
     def getEntityFromUsername(self, username):
-        for world in self._worlds.values():
-            for entity in world.entityManager.entities.values():
-                if entity.username == username:
-                    return entity
-
-        return None
+        return self._usernames.get(username.lower())
 
     def getNumPlayers(self):
-        numPlayers = 0
+        return self._numPlayers
 
-        for world in self._worlds.values():
-            for entity in world.entityManager.entities.values():
-                if entity.isPlayer():
-                    numPlayers += 1
+    def registerPlayer(self, world, playerEntity):
+        # usernames are case insensitive, so two players can't log in as
+        # the same name with a different case.
+        username = playerEntity.username.lower()
 
-        return numPlayers
+        if username in self._usernames:
+            raise WorldManagerError('Player %s is already logged in!' % playerEntity.username)
+
+        self._usernames[username] = playerEntity
+        self._entityWorlds[playerEntity] = world
+        self._numPlayers += 1
+
+    def unregisterPlayer(self, world, playerEntity):
+        if self._entityWorlds.get(playerEntity) is not world:
+            return
+
+        del self._usernames[playerEntity.username.lower()]
+        del self._entityWorlds[playerEntity]
+        self._numPlayers -= 1
 
     def addWorld(self, world):
         if world.name in self._worlds:
@@ -329,6 +1097,9 @@ class WorldManager(WorldManagerIO):
 
         self._worlds[world.name] = world
 
+        if len(self._worlds) > self.maxWorlds:
+            self.evictWorlds(world)
+
     def removeWorld(self, world):
         if world.name not in self._worlds:
             return
@@ -336,23 +1107,90 @@ class WorldManager(WorldManagerIO):
         del self._worlds[world.name]
 
     def getWorld(self, name):
-        return self._worlds.get(name)
+        world = self._worlds.pop(name, None)
+
+        if world:
+            # move the world to the end, it's now the most recently used.
+            self._worlds[name] = world
+            return world
+
+        if name in self._unloading:
+            if name in self._closing:
+                return None
+
+            world = self._unloading.pop(name)
+            self.addWorld(world)
+            return world
+
+        if name not in self._worldNames:
+            return None
+
+        return self.load(name)
 
     def create(self, worldName):
         super(WorldManager, self).create(worldName)
 
         # setup a new world instance and generate the block data.
-        world = World(self, worldName)
+        width, height, depth = self.getWorldDimensions(worldName)
+        world = World(self, worldName, width=width, height=height, depth=depth)
+
+        if self.worldFormat == 'region':
+            self.createRegion(world)
+
+        self.openJournal(world)
         world.save()
 
         # add the world to the list of active worlds
         self.addWorld(world)
+        return world
 
     def load(self, worldName):
         super(WorldManager, self).load(worldName)
+        startTime = time.time()
+
+        # open the world file and load the world data into memory, the file
+        # a world was converted from is moved aside so only one of them is
+        # ever loaded. a region file is only renamed into place once it's
+        # complete, so if both exist the region file is the newer one.
+        filePath = self.getFilePath(worldName)
+        regionPath = self.getRegionPath(worldName)
+        width, height, depth = self.getWorldDimensions(worldName)
+
+        if os.path.exists(regionPath):
+            worldRegion = region.RegionFile(regionPath, width, height, depth)
+            worldRegion.open()
+
+            world = World(self, worldName, worldRegion.readBlockData(), width, height, depth)
+
+            if self.worldFormat == 'region':
+                world.region = worldRegion
+            else:
+                logging.Logger.info('Converting world [%s] to a dat file...', worldName)
+                worldRegion.close()
+
+                self.writeAtomic(filePath, world.serialize())
+                self.moveAside(regionPath)
+        else:
+            world = World(self, worldName, World.load(self.read(filePath, 'rb'), width, height, depth),
+                width, height, depth)
+
+            if self.worldFormat == 'region':
+                logging.Logger.info('Converting world [%s] to a region file...', worldName)
+
+                self.createRegion(world)
+                self.moveAside(filePath)
+
+        self.openJournal(world)
+
+        # checkpoint the replayed changes so the journal doesn't keep growing.
+        if world.version:
+            world.save()
+
+        self._loadStats.record(time.time() - startTime)
 
-        # open the world file and load the world data into memory
-        world = World(self, worldName, World.load(self.read(self.getFilePath(worldName), 'rb')))
+        logging.Logger.info('Loaded world [%s] in %.2f ms.', worldName,
+            self._loadStats.last * 1000.0)
 
         # add the world to the list of active worlds
         self.addWorld(world)
+        return world